@@ -0,0 +1,250 @@
+'''
+Backends de arrays usados pelos kernels do Algorithms (transformer_num.py)
+
+    numpy -> padrão, CPU (BLAS multithread)
+    numba -> CPU, kernels compilados e paralelos entre fatias (ou blocos de frames) e blocos de linhas: o produto
+             compactado dos momentos dos blocos usado pelo processTrajectory e o kernel que centraliza, acumula
+             a covariância e normaliza cada fatia em uma única passada (necessita do pacote 'numba')
+    cupy  -> GPU, necessita do pacote 'cupy' e de uma GPU CUDA disponível
+
+Os kernels usam 'backend.xp' no lugar do módulo numpy e devolvem os resultados na CPU (toHost), os arquivos
+e os momentos acumulados continuam em numpy. Novos backends são registrados com registerBackend.
+'''
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+class NumpyBackend:
+    name = 'numpy'
+    on_host = True
+    # Backends com kernel fundido implementam fusedDCCM, fusedDCCMpacked, packedGram e dccmFromMoments (momentos dos blocos)
+    fused = False
+
+    def __init__(self):
+        self.xp = np
+
+    @staticmethod
+    def isAvailable():
+        return True
+
+    def asarray(self, array, dtype=None):
+        # Transfere para o dispositivo do backend (sem cópia no numpy quando o dtype já é o mesmo)
+        return self.xp.asarray(array, dtype=dtype)
+
+    def toHost(self, array, out=None):
+        # Devolve o resultado como numpy, escrevendo em 'out' quando fornecido
+        if out is None or out is array:
+            return array
+        out[...] = array
+        return out
+
+
+class CupyBackend(NumpyBackend):
+    name = 'cupy'
+    on_host = False
+
+    def __init__(self):
+        import cupy
+        self.xp = cupy
+
+    @staticmethod
+    def isAvailable():
+        try:
+            import cupy
+            return cupy.cuda.runtime.getDeviceCount() > 0
+        except Exception:
+            # Pacote ausente ou sem driver/GPU CUDA
+            return False
+
+    def toHost(self, array, out=None):
+        host = self.xp.asnumpy(array)
+        if out is None:
+            return host
+        out[...] = host
+        return out
+
+
+if numba is not None:
+
+    @numba.njit(parallel=True, cache=True)
+    def _centeredFluctuations(coords, fluctuations, norms):
+        # Flutuações em relação à média de cada fatia no layout (n_slices, n_atoms, n_frames * 3), contíguo por átomo,
+        # e sqrt(variância + 1e-10) de cada átomo
+        n_slices, n_frames, n_atoms, _ = coords.shape
+        for s in numba.prange(n_slices):
+            for i in range(n_atoms):
+                variance = 0.0
+                for c in range(3):
+                    total = 0.0
+                    for t in range(n_frames):
+                        total += coords[s, t, i, c]
+                    mean = total / n_frames
+                    for t in range(n_frames):
+                        delta = coords[s, t, i, c] - mean
+                        fluctuations[s, i, t * 3 + c] = delta
+                        variance += delta * delta
+                norms[s, i] = np.sqrt(variance / n_frames + 1e-10)
+
+    @numba.njit(parallel=True, cache=True)
+    def _fusedDCCM(fluctuations, norms, out, block_rows):
+        # Cada tarefa é um bloco de linhas de uma fatia: produto do bloco pelas colunas k >= r0 (BLAS),
+        # normalizado e escrito direto na saída, espelhando no triângulo inferior
+        n_slices, n_atoms, n_values = fluctuations.shape
+        n_blocks = (n_atoms + block_rows - 1) // block_rows
+        for task in numba.prange(n_slices * n_blocks):
+            s = task // n_blocks
+            r0 = (task % n_blocks) * block_rows
+            r1 = min(r0 + block_rows, n_atoms)
+            block = np.dot(fluctuations[s, r0:r1], fluctuations[s, r0:].T)
+            for i in range(r0, r1):
+                scale = np.float32(1.0) / (n_values // 3) / norms[s, i]
+                for k in range(i, n_atoms):
+                    value = block[i - r0, k - r0] * scale / norms[s, k]
+                    out[s, i, k] = value
+                    out[s, k, i] = value
+
+    @numba.njit(parallel=True, cache=True)
+    def _fusedDCCMpacked(fluctuations, norms, out, block_rows):
+        # Mesmo cálculo do _fusedDCCM, escrevendo direto no triângulo superior compactado
+        n_slices, n_atoms, n_values = fluctuations.shape
+        n_blocks = (n_atoms + block_rows - 1) // block_rows
+        for task in numba.prange(n_slices * n_blocks):
+            s = task // n_blocks
+            r0 = (task % n_blocks) * block_rows
+            r1 = min(r0 + block_rows, n_atoms)
+            block = np.dot(fluctuations[s, r0:r1], fluctuations[s, r0:].T)
+            for i in range(r0, r1):
+                offset = i * n_atoms - (i * (i - 1)) // 2
+                scale = np.float32(1.0) / (n_values // 3) / norms[s, i]
+                for k in range(i, n_atoms):
+                    out[s, offset + k - i] = block[i - r0, k - r0] * scale / norms[s, k]
+
+
+    @numba.njit(parallel=True, cache=True)
+    def _packedGram(vectors, out, block_rows):
+        # Triângulo superior compactado de vectors @ vectors^T de cada lote, (n, n_atoms, k) -> (n, num_elementos_triangulo)
+        # Usado nos momentos dos blocos (Σ_t r_i(t)·r_k(t)) e nos produtos das médias, paralelo entre lotes e blocos de linhas
+        n_batch, n_atoms, _ = vectors.shape
+        n_blocks = (n_atoms + block_rows - 1) // block_rows
+        for task in numba.prange(n_batch * n_blocks):
+            b = task // n_blocks
+            r0 = (task % n_blocks) * block_rows
+            r1 = min(r0 + block_rows, n_atoms)
+            block = np.dot(vectors[b, r0:r1], vectors[b, r0:].T)
+            for i in range(r0, r1):
+                offset = i * n_atoms - (i * (i - 1)) // 2
+                for k in range(i, n_atoms):
+                    out[b, offset + k - i] = block[i - r0, k - r0]
+
+
+    @numba.njit(parallel=True, cache=True)
+    def _dccmFromMoments(counts, sums, cross, out):
+        # Covariância C_ik = <r_i·r_k> - <r_i>·<r_k> a partir dos momentos somados de cada janela, normalizada
+        # pelas variâncias e escrita em float32 no layout compactado, sem matrizes temporárias
+        n_windows, n_atoms, _ = sums.shape
+        diag_sqrt = np.empty((n_windows, n_atoms))
+        for w in numba.prange(n_windows):
+            n = counts[w]
+            for i in range(n_atoms):
+                offset = i * n_atoms - (i * (i - 1)) // 2
+                mean_product = (sums[w, i, 0] * sums[w, i, 0] + sums[w, i, 1] * sums[w, i, 1] + sums[w, i, 2] * sums[w, i, 2]) / (n * n)
+                diag_sqrt[w, i] = np.sqrt(cross[w, offset] / n - mean_product + 1e-10)
+        for task in numba.prange(n_windows * n_atoms):
+            w = task // n_atoms
+            i = task % n_atoms
+            n = counts[w]
+            offset = i * n_atoms - (i * (i - 1)) // 2
+            for k in range(i, n_atoms):
+                mean_product = (sums[w, i, 0] * sums[w, k, 0] + sums[w, i, 1] * sums[w, k, 1] + sums[w, i, 2] * sums[w, k, 2]) / (n * n)
+                out[w, offset + k - i] = (cross[w, offset + k - i] / n - mean_product) / (diag_sqrt[w, i] * diag_sqrt[w, k])
+
+
+class NumbaBackend(NumpyBackend):
+    name = 'numba'
+    fused = True
+
+    def __init__(self, block_rows=64):
+        self.xp = np
+        self.block_rows = block_rows
+
+    @staticmethod
+    def isAvailable():
+        return numba is not None
+
+    def centeredFluctuations(self, sliced_traj):
+        # Único temporário do tamanho da entrada, as matrizes de covariância e normalização não são alocadas
+        coords = np.ascontiguousarray(sliced_traj, dtype=np.float32)
+        n_slices, n_frames, n_atoms, _ = coords.shape
+        fluctuations = np.empty((n_slices, n_atoms, n_frames * 3), dtype=np.float32)
+        norms = np.empty((n_slices, n_atoms), dtype=np.float32)
+        _centeredFluctuations(coords, fluctuations, norms)
+        return fluctuations, norms
+
+    def packedGram(self, vectors, out):
+        # Mesmo resultado do Algorithms.packedGram, em float64 como os momentos acumulados
+        _packedGram(np.ascontiguousarray(vectors, dtype=np.float64), out, self.block_rows)
+        return out
+
+    def dccmFromMoments(self, counts, sums, cross):
+        # Mesmo resultado do Algorithms.dccmFromMoments, (n_windows, num_elementos_triangulo) em float32
+        out = np.empty(cross.shape, dtype=np.float32)
+        _dccmFromMoments(counts.astype(np.float64), np.ascontiguousarray(sums, dtype=np.float64),
+                         np.ascontiguousarray(cross, dtype=np.float64), out)
+        return out
+
+    def fusedDCCM(self, sliced_traj, out=None):
+        # (n_slices, n_frames, n_atoms, 3) -> (n_slices, n_atoms, n_atoms), sem matrizes temporárias do tamanho da saída
+        n_slices, _, n_atoms, _ = sliced_traj.shape
+        if out is None:
+            out = np.empty((n_slices, n_atoms, n_atoms), dtype=np.float32)
+        _fusedDCCM(*self.centeredFluctuations(sliced_traj), out, self.block_rows)
+        return out
+
+    def fusedDCCMpacked(self, sliced_traj, out=None):
+        # (n_slices, n_frames, n_atoms, 3) -> (n_slices, num_elementos_triangulo)
+        n_slices, _, n_atoms, _ = sliced_traj.shape
+        if out is None:
+            out = np.empty((n_slices, n_atoms * (n_atoms + 1) // 2), dtype=np.float32)
+        _fusedDCCMpacked(*self.centeredFluctuations(sliced_traj), out, self.block_rows)
+        return out
+
+
+BACKENDS = {'numpy': NumpyBackend, 'numba': NumbaBackend, 'cupy': CupyBackend}
+
+# Ordem de preferência do 'auto', o último deve estar sempre disponível (fallback para CPU)
+AUTO_ORDER = ['cupy', 'numba', 'numpy']
+
+
+def registerBackend(name, backend_class, prefer=False):
+    # Registra um novo backend, com prefer=True ele é tentado antes dos demais no 'auto'
+    BACKENDS[name] = backend_class
+    if name not in AUTO_ORDER:
+        if prefer:
+            AUTO_ORDER.insert(0, name)
+        else:
+            AUTO_ORDER.insert(len(AUTO_ORDER) - 1, name)
+
+
+def availableBackends():
+    return [name for name, backend_class in BACKENDS.items() if backend_class.isAvailable()]
+
+
+def getBackend(name=None):
+    # None usa o numpy, 'auto' escolhe o primeiro backend disponível de AUTO_ORDER
+    if name is None:
+        name = 'numpy'
+    if not isinstance(name, str):
+        # Já é uma instância de backend
+        return name
+    if name == 'auto':
+        name = next(candidate for candidate in AUTO_ORDER if BACKENDS[candidate].isAvailable())
+    if name not in BACKENDS:
+        raise ValueError(f"Backend desconhecido: {name} (disponíveis: {', '.join(sorted(BACKENDS))})")
+    if not BACKENDS[name].isAvailable():
+        raise RuntimeError(f"Backend '{name}' não está disponível nesta máquina")
+    return BACKENDS[name]()
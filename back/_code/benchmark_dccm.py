@@ -0,0 +1,213 @@
+'''
+Benchmark dos kernels de DCCM: caminho original (einsum fatia a fatia) contra o kernel em lote (matmul)
+
+Com --suite executa o benchmark do pipeline em trajetórias sintéticas (frames × átomos), medindo separadamente
+slicedTrajectory, calculateDCCM, calculateDCCMxyz, os kernels compactados e a escrita do arquivo, com tempo e pico de memória.
+O relatório em JSON (--report) registra o commit e pode ser comparado com o de outro commit (--compare).
+'''
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+import numpy as np
+
+from transformer_num import dataTranformer
+from dccm_container import encodeNames
+
+
+def syntheticSlices(n_slices, n_frames, n_atoms, seed=0):
+    # Gera coordenadas aleatórias no formato (n_slices, n_frames, n_atoms, 3)
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n_slices, n_frames, n_atoms, 3)).astype(np.float32)
+
+
+def syntheticTrajectory(n_frames, n_atoms, seed=0):
+    # Trajetória (n_frames, n_atoms, 3) com movimentos coletivos de alguns domínios mais ruído térmico,
+    # gerando correlações positivas dentro de cada domínio
+    rng = np.random.default_rng(seed)
+    structure = rng.normal(scale=2.0, size=(n_atoms, 3))
+    n_domains = max(1, n_atoms // 50)
+    domain = rng.integers(n_domains, size=n_atoms)
+    motion = np.cumsum(rng.normal(scale=0.01, size=(n_frames, n_domains, 3)), axis=0)
+    noise = rng.normal(scale=0.05, size=(n_frames, n_atoms, 3))
+    return (structure + motion[:, domain] + noise).astype(np.float32)
+
+
+def peakMemory(function):
+    # Pico de memória alocada (MB) durante uma execução, o numpy registra seus buffers no tracemalloc
+    tracemalloc.start()
+    try:
+        result = function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024), result
+
+
+def quietly(function, *args):
+    # Descarta as mensagens impressas pela função (ex: writeDCCMFile) para não poluir a tabela
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+def gitRevision():
+    # Commit atual e se há alterações não commitadas, para identificar o relatório
+    path = os.path.dirname(os.path.abspath(__file__))
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=path, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=path, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return revision, dirty
+
+
+def bestTime(function, repeats):
+    # Melhor tempo de 'repeats' execuções, reduz o ruído de outros processos
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def runSuite(algs, trajectory_frames, trajectory_atoms, windows, repeats, tolerance=1e-4):
+    # Cada etapa é executada 'repeats' vezes para o tempo e uma vez com o tracemalloc para o pico de memória
+    results = []
+    equivalence = []
+    output_dir = tempfile.mkdtemp(prefix='dccm_benchmark_')
+
+    def measure(case, stage, function):
+        seconds, result = bestTime(function, repeats)
+        peak_mb, _ = peakMemory(function)
+        results.append(dict(case, stage=stage, seconds=seconds, peak_mb=peak_mb))
+        print(f"{case['frames']:>8} {case['atoms']:>7} {str(case['window']):>7} {stage:>26} {seconds:>10.4f} {peak_mb:>10.1f}")
+        return result
+
+    print(f"{'frames':>8} {'atomos':>7} {'janela':>7} {'etapa':>26} {'tempo (s)':>10} {'pico (MB)':>10}")
+    for n_frames in trajectory_frames:
+        for n_atoms in trajectory_atoms:
+            traj = syntheticTrajectory(n_frames, n_atoms)
+            names = ['ALA'] * n_atoms
+            encoded_names = encodeNames(names)
+            rows, cols = np.triu_indices(n_atoms)
+
+            valid_windows = [window for window in windows if window <= n_frames]
+            case = {'frames': n_frames, 'atoms': n_atoms, 'window': None}
+            multi = measure(case, 'calculateMultiWindowDCCM', lambda: algs.calculateMultiWindowDCCM(traj, valid_windows))
+
+            for window in valid_windows:
+                case = {'frames': n_frames, 'atoms': n_atoms, 'window': window}
+                sliced = measure(case, 'slicedTrajectory', lambda: algs.slicedTrajectory(traj, window))
+                einsum = measure(case, 'calculateDCCM', lambda: np.stack([algs.calculateDCCM(s) for s in sliced]))
+                measure(case, 'calculateDCCMxyz', lambda: [algs.calculateDCCMxyz(s) for s in sliced])
+                batched = measure(case, 'calculateDCCMfromSlices', lambda: algs.calculateDCCMfromSlices(sliced))
+                packed = measure(case, 'calculateDCCMpacked', lambda: algs.calculateDCCMpacked(sliced))
+
+                output_filename = os.path.join(output_dir, f'dccm_data_{window}.bin')
+                measure(case, 'writeDCCMFile', lambda: quietly(algs.writeDCCMFile, output_filename, packed, n_atoms, encoded_names))
+                os.remove(output_filename)
+
+                # Todos os kernels devem concordar com o caminho original (einsum), comparados no layout compactado
+                reference = einsum[:, rows, cols].astype(np.float32)
+                for kernel, values in (('calculateDCCMfromSlices', batched[:, rows, cols]), ('calculateDCCMpacked', packed),
+                                       ('calculateMultiWindowDCCM', multi[window])):
+                    max_diff = float(np.abs(reference - values).max()) if reference.size else 0.0
+                    equivalence.append(dict(case, kernel=kernel, reference='calculateDCCM', max_diff=max_diff, ok=max_diff <= tolerance))
+                    if max_diff > tolerance:
+                        print(f"DIVERGÊNCIA: {kernel} difere do calculateDCCM em {max_diff:.2e} (janela {window}, {n_frames}x{n_atoms})")
+
+    os.rmdir(output_dir)
+    return results, equivalence
+
+
+def compareReports(baseline, report, threshold):
+    # Compara tempo e memória de cada etapa com o relatório de outro commit, razão > threshold é considerada regressão
+    key = lambda result: (result['frames'], result['atoms'], result['window'], result['stage'])
+    previous = {key(result): result for result in baseline['results']}
+
+    regressions = 0
+    print(f"Comparação com {baseline.get('git_revision')} (limite {threshold:.2f}x)")
+    print(f"{'frames':>8} {'atomos':>7} {'janela':>7} {'etapa':>26} {'antes (s)':>10} {'agora (s)':>10} {'razão':>7} {'memória':>8}")
+    for result in report['results']:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        ratio = result['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+        memory_ratio = result['peak_mb'] / old['peak_mb'] if old['peak_mb'] else 1.0
+        regression = ratio > threshold or memory_ratio > threshold
+        regressions += regression
+        print(f"{result['frames']:>8} {result['atoms']:>7} {str(result['window']):>7} {result['stage']:>26} "
+              f"{old['seconds']:>10.4f} {result['seconds']:>10.4f} {ratio:>6.2f}x {memory_ratio:>7.2f}x{'  REGRESSÃO' if regression else ''}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Compara o kernel einsum com o kernel matmul em lote')
+    parser.add_argument('--atoms', type=int, nargs='+', default=[300, 1000, 5000])
+    parser.add_argument('--frames', type=int, default=25, help='Tamanho da janela (frames por fatia)')
+    parser.add_argument('--slices', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--backend', default='numpy', help="Backend de arrays dos kernels (numpy, cupy ou auto)")
+    parser.add_argument('--suite', action='store_true', help='Benchmark do pipeline completo em trajetórias sintéticas')
+    parser.add_argument('--trajectory-frames', type=int, nargs='+', default=[2000, 10000], help='Frames das trajetórias sintéticas (--suite)')
+    parser.add_argument('--trajectory-atoms', type=int, nargs='+', default=[100, 300], help='Átomos das trajetórias sintéticas (--suite)')
+    parser.add_argument('--windows', type=int, nargs='+', default=[25, 100, 400], help='Tamanhos de janela (--suite)')
+    parser.add_argument('--report', default=None, help='Arquivo JSON com os resultados do --suite')
+    parser.add_argument('--compare', default=None, help='Relatório JSON de outro commit para comparação')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Razão de tempo ou memória considerada regressão')
+    args = parser.parse_args()
+
+    algs = dataTranformer(args.backend).algs
+
+    if args.suite:
+        results, equivalence = runSuite(algs, args.trajectory_frames, args.trajectory_atoms, args.windows, args.repeats)
+        revision, dirty = gitRevision()
+        report = {
+            'git_revision': revision,
+            'git_dirty': dirty,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'backend': algs.backend.name,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeats': args.repeats,
+            'results': results,
+            'equivalence': equivalence,
+        }
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Relatório salvo em '{args.report}'")
+
+        failures = sum(not check['ok'] for check in equivalence)
+        if args.compare:
+            with open(args.compare, 'r') as f:
+                failures += compareReports(json.load(f), report, args.threshold)
+        return 1 if failures else 0
+
+    print(f"{'atomos':>8} {'einsum (s)':>12} {'matmul (s)':>12} {'speedup':>9} {'max |diff|':>12}")
+    for n_atoms in args.atoms:
+        sliced = syntheticSlices(args.slices, args.frames, n_atoms)
+
+        einsum_time, einsum_result = bestTime(lambda: np.stack([algs.calculateDCCM(s) for s in sliced]), args.repeats)
+        einsum_result = einsum_result.astype(np.float32)
+        batched_time, batched_result = bestTime(lambda: algs.calculateDCCMbatched(sliced), args.repeats)
+
+        max_diff = np.abs(einsum_result - batched_result).max()
+        print(f"{n_atoms:>8} {einsum_time:>12.4f} {batched_time:>12.4f} {einsum_time / batched_time:>8.1f}x {max_diff:>12.2e}")
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
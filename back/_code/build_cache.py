@@ -0,0 +1,96 @@
+'''
+Cache incremental dos arquivos gerados pelo pré-processamento (dccm_data_*.bin)
+
+Cada réplica guarda um manifesto (dccm_manifest.json) com o hash das entradas, os parâmetros
+e a versão do algoritmo utilizados para gerar cada arquivo. Uma nova execução só recalcula o que estiver desatualizado.
+'''
+
+import os
+import json
+import hashlib
+
+try:
+    import fcntl
+except ImportError:
+    # Sem trava de arquivo fora de sistemas Unix
+    fcntl = None
+
+MANIFEST_NAME = 'dccm_manifest.json'
+
+
+class BuildCache:
+
+    def __init__(self, parent):
+        self.utils = parent
+
+    def manifestPath(self, path):
+        return os.path.join(path, MANIFEST_NAME)
+
+    def loadManifest(self, path):
+        # Manifesto vazio caso ainda não exista ou esteja corrompido
+        try:
+            with open(self.manifestPath(path), 'r') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            manifest = {}
+        manifest.setdefault('inputs', {})
+        manifest.setdefault('outputs', {})
+        return manifest
+
+    def fileDigest(self, file_path, cached=None):
+        # sha256 do conteúdo do arquivo, reaproveitando o hash do manifesto quando tamanho e data de modificação não mudaram
+        stat = os.stat(file_path)
+        if cached and cached.get('size') == stat.st_size and cached.get('mtime_ns') == stat.st_mtime_ns:
+            return cached
+
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+
+    def inputDigests(self, manifest, input_paths):
+        # Atualiza no manifesto o hash de cada entrada e devolve {nome: sha256}
+        digests = {}
+        for name, file_path in input_paths.items():
+            entry = self.fileDigest(file_path, manifest['inputs'].get(name))
+            manifest['inputs'][name] = entry
+            digests[name] = entry['sha256']
+        return digests
+
+    def isFresh(self, manifest, path, output_name, input_digests, settings):
+        # Um arquivo está atualizado se foi gerado com as mesmas entradas e parâmetros e ainda existe no disco com o mesmo tamanho
+        entry = manifest['outputs'].get(output_name)
+        if entry is None or entry.get('inputs') != input_digests or entry.get('settings') != settings:
+            return False
+
+        # Janelas maiores que a trajetória não geram arquivo, mas também ficam registradas
+        if entry.get('size') is None:
+            return True
+        output_path = os.path.join(path, output_name)
+        return os.path.exists(output_path) and os.path.getsize(output_path) == entry['size']
+
+    def recordOutput(self, path, manifest, output_name, input_digests, settings):
+        # Registra um arquivo recém gerado, 'size' None indica que nenhum arquivo foi gerado para estes parâmetros
+        output_path = os.path.join(path, output_name)
+        size = os.path.getsize(output_path) if os.path.exists(output_path) else None
+        manifest['outputs'][output_name] = {'inputs': input_digests, 'settings': settings, 'size': size}
+        self.saveManifest(path, manifest, [output_name])
+
+    def saveManifest(self, path, manifest, output_names=()):
+        # Outros processos podem estar escrevendo outras janelas da mesma réplica (--split-windows),
+        # então o manifesto é relido com trava e apenas as entradas deste processo são atualizadas
+        lock_path = self.manifestPath(path) + '.lock'
+        with open(lock_path, 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            current = self.loadManifest(path)
+            current['inputs'].update(manifest['inputs'])
+            for name in output_names:
+                current['outputs'][name] = manifest['outputs'][name]
+
+            temp_path = self.manifestPath(path) + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(current, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.manifestPath(path))
@@ -0,0 +1,266 @@
+'''
+Container versionado com todas as janelas de uma réplica em um único arquivo (dccm_data.dccm)
+
+Layout (little-endian):
+    Header (32 bytes)  '<4sIIIIII4x' magic b'DCCM', versão, num_atomos, num_janelas, tipo_dado_id, compressao, intervalo entre keyframes do delta
+    Nomes              num_atomos * 4 bytes, mesmo formato dos arquivos .bin
+    Tabela de janelas  num_janelas * '<IIQ'  (slice_size, num_fatias, posição do índice de fatias)
+    Índice de fatias   num_fatias * '<QQ' por janela  (posição da fatia no arquivo, tamanho em bytes)
+    Dados              bloco de cada janela alinhado à página (4096 bytes), fatias alinhadas a 64 bytes dentro do bloco
+
+Com o índice, qualquer fatia pode ser mapeada (np.memmap) ou buscada isoladamente com uma requisição HTTP Range.
+As codificações (tipo_dado_id) e compressões das fatias estão descritas em dccm_encoding.py.
+'''
+
+import struct
+import numpy as np
+
+from dccm_encoding import ENCODED_DTYPES, TIPO_FLOAT32, TIPO_SPARSE_COO, SPARSE_EDGE_DTYPE, decodeSlice, decodeValues, encodeValues
+
+MAGIC = b'DCCM'
+CONTAINER_VERSION = 1
+HEADER_FORMAT = '<4sIIIIII4x'
+WINDOW_FORMAT = '<IIQ'
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('nbytes', '<u8')])
+
+# Alinhamento do bloco de cada janela e de cada fatia dentro do bloco
+PAGE_SIZE = 4096
+SLICE_ALIGNMENT = 64
+
+# Bytes do nome de cada resíduo (ou domínio) nos arquivos .bin e no container
+NAME_BYTES = 4
+
+
+def alignUp(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def encodeNames(names):
+    # Nomes em UTF-8 completados com '\0' até 4 bytes, um nome maior desalinharia o bloco de nomes e as fatias seguintes
+    encoded = [name.encode('utf-8') for name in names]
+    too_long = [name for name, raw in zip(names, encoded) if len(raw) > NAME_BYTES]
+    if too_long:
+        raise ValueError(f"Nomes com mais de {NAME_BYTES} bytes não cabem no formato .bin: {', '.join(too_long[:5])}")
+    return b''.join(raw.ljust(NAME_BYTES, b'\0') for raw in encoded)
+
+
+def writeDCCMContainer(output_filename, windows, num_atomos, encoded_names, tipo_dado_id=1, compressao=0, keyframe=0):
+    # windows: {slice_size: fatias já codificadas}, cada fatia é um objeto com buffer (array numpy ou bytes)
+    slice_sizes = sorted(windows)
+    header_size = struct.calcsize(HEADER_FORMAT)
+    names_size = num_atomos * 4
+    table_size = len(slice_sizes) * struct.calcsize(WINDOW_FORMAT)
+
+    # Posição de cada índice de fatias, logo após a tabela de janelas
+    index_offsets = []
+    position = header_size + names_size + table_size
+    for slice_size in slice_sizes:
+        index_offsets.append(position)
+        position += len(windows[slice_size]) * INDEX_DTYPE.itemsize
+
+    # Posição de cada fatia, o bloco de cada janela começa em uma nova página
+    indexes = []
+    for slice_size in slice_sizes:
+        position = alignUp(position, PAGE_SIZE)
+        index = np.zeros(len(windows[slice_size]), dtype=INDEX_DTYPE)
+        for i, fatia in enumerate(windows[slice_size]):
+            nbytes = memoryview(fatia).nbytes
+            index[i] = (position, nbytes)
+            position = alignUp(position + nbytes, SLICE_ALIGNMENT)
+        indexes.append(index)
+
+    with open(output_filename, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, CONTAINER_VERSION, num_atomos, len(slice_sizes), tipo_dado_id, compressao, keyframe))
+        f.write(encoded_names)
+        for slice_size, index_offset in zip(slice_sizes, index_offsets):
+            f.write(struct.pack(WINDOW_FORMAT, slice_size, len(windows[slice_size]), index_offset))
+        for index in indexes:
+            f.write(index.tobytes())
+
+        for slice_size, index in zip(slice_sizes, indexes):
+            for fatia, (offset, _) in zip(windows[slice_size], index):
+                # Preenche com zeros até a posição alinhada da fatia
+                f.write(b'\0' * (int(offset) - f.tell()))
+                f.write(memoryview(fatia).cast('B'))
+        # Tamanho real do arquivo, a última fatia não é preenchida até o alinhamento
+        return f.tell()
+
+
+class DCCMContainer:
+    # Leitor dos arquivos .dccm, fatias float32 sem compressão são visões do arquivo mapeado em memória (sem cópias),
+    # as demais codificações são decodificadas para float32
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.data = np.memmap(file_path, dtype=np.uint8, mode='r')
+
+        magic, version, self.num_atomos, num_janelas, self.tipo_dado_id, self.compressao, self.keyframe = struct.unpack_from(HEADER_FORMAT, self.data)
+        if magic != MAGIC:
+            raise ValueError(f"'{file_path}' não é um container DCCM")
+        if version > CONTAINER_VERSION:
+            raise ValueError(f"Versão {version} do container não suportada")
+        self.version = version
+
+        # Nomes dos resíduos
+        names_offset = struct.calcsize(HEADER_FORMAT)
+        names_block = bytes(self.data[names_offset:names_offset + self.num_atomos * 4])
+        self.names = [names_block[i:i + 4].rstrip(b'\0').decode('utf-8') for i in range(0, len(names_block), 4)]
+
+        # Tabela de janelas e índice de fatias de cada uma
+        self.num_elementos_triangulo = self.num_atomos * (self.num_atomos + 1) // 2
+        self.indexes = {}
+        table_offset = names_offset + self.num_atomos * 4
+        for w in range(num_janelas):
+            slice_size, num_fatias, index_offset = struct.unpack_from(WINDOW_FORMAT, self.data, table_offset + w * struct.calcsize(WINDOW_FORMAT))
+            self.indexes[slice_size] = np.frombuffer(self.data, dtype=INDEX_DTYPE, count=num_fatias, offset=index_offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # O mapeamento é liberado quando não houver mais visões das fatias em uso
+        self.data = None
+        self.indexes = {}
+
+    @property
+    def slice_sizes(self):
+        return sorted(self.indexes)
+
+    def numSlices(self, slice_size):
+        return len(self.indexes[slice_size])
+
+    def sliceRange(self, slice_size, index):
+        # Intervalo de bytes da fatia no arquivo, útil para requisições HTTP Range
+        offset, nbytes = self.indexes[slice_size][index]
+        return int(offset), int(nbytes)
+
+    def rawSlice(self, slice_size, index):
+        # Bytes da fatia como estão no arquivo
+        offset, nbytes = self.sliceRange(slice_size, index)
+        return self.data[offset:offset + nbytes]
+
+    def slice(self, slice_size, index):
+        # Triângulo superior compactado de uma fatia (num_elementos_triangulo,) em float32
+        if self.compressao == 0:
+            encoded = self.rawSlice(slice_size, index).view(ENCODED_DTYPES[self.tipo_dado_id])
+            return encoded if self.tipo_dado_id == TIPO_FLOAT32 else decodeValues(encoded, self.tipo_dado_id)
+        return decodeSlice(lambda i: self.rawSlice(slice_size, i), index, self.num_elementos_triangulo,
+                           self.tipo_dado_id, self.compressao, self.keyframe)
+
+    def window(self, slice_size):
+        # Todas as fatias de uma janela (num_fatias, num_elementos_triangulo)
+        index = self.indexes[slice_size]
+        if len(index) == 0:
+            return np.zeros((0, self.num_elementos_triangulo), dtype=np.float32)
+        if self.compressao != 0:
+            return np.stack([self.slice(slice_size, i) for i in range(len(index))])
+
+        # Sem compressão as fatias têm tamanho fixo, a janela é uma visão com passo fixo entre fatias alinhadas
+        dtype = np.dtype(ENCODED_DTYPES[self.tipo_dado_id])
+        stride = int(index[1]['offset'] - index[0]['offset']) if len(index) > 1 else int(index[0]['nbytes'])
+        encoded = np.ndarray((len(index), self.num_elementos_triangulo), dtype=dtype, buffer=self.data,
+                             offset=int(index[0]['offset']), strides=(stride, dtype.itemsize))
+        return encoded if self.tipo_dado_id == TIPO_FLOAT32 else decodeValues(encoded, self.tipo_dado_id)
+
+    def sliceAtFrame(self, slice_size, frame):
+        # Índice da fatia que contém o frame, permite navegar entre níveis de resolução (ex: dccm_pyramid.dccm)
+        # mantendo a mesma posição no tempo
+        return min(frame // slice_size, self.numSlices(slice_size) - 1)
+
+    def sliceMatrix(self, slice_size, index):
+        # Reconstrói a matriz N×N simétrica de uma fatia (cópia)
+        matrix = np.zeros((self.num_atomos, self.num_atomos), dtype=np.float32)
+        rows, cols = np.triu_indices(self.num_atomos)
+        matrix[rows, cols] = self.slice(slice_size, index)
+        matrix[cols, rows] = matrix[rows, cols]
+        return matrix
+
+
+class DCCMFileWriter:
+    # Escreve um arquivo dccm_data_*.bin em lotes de fatias conforme são calculadas,
+    # o header é escrito com num_fatias 0 e corrigido ao fechar
+
+    def __init__(self, output_filename, encoded_names, tipo_dado_id=TIPO_FLOAT32):
+        self.output_filename = output_filename
+        self.num_atomos = len(encoded_names) // 4
+        self.tipo_dado_id = tipo_dado_id
+        self.num_fatias = 0
+        self.erro_maximo = 0.0
+        self.size = None
+        self.file = open(output_filename, 'wb')
+        self.file.write(struct.pack('<III', 0, self.num_atomos, tipo_dado_id))
+        self.file.write(encoded_names)
+
+    def append(self, dados_compactados):
+        # Fatias compactadas (n, num_elementos_triangulo) em float32, convertidas para a codificação do tipo_dado_id
+        dados_codificados = encodeValues(dados_compactados, self.tipo_dado_id)
+        self.file.write(dados_codificados.tobytes())
+        self.num_fatias += len(dados_compactados)
+        if self.tipo_dado_id != TIPO_FLOAT32 and len(dados_compactados) > 0:
+            erro = np.abs(decodeValues(dados_codificados, self.tipo_dado_id) - dados_compactados).max()
+            self.erro_maximo = max(self.erro_maximo, float(erro))
+
+    def close(self):
+        # Corrige o num_fatias do header e devolve o tamanho final do arquivo
+        if not self.file.closed:
+            self.size = self.file.tell()
+            self.file.seek(0)
+            self.file.write(struct.pack('<III', self.num_fatias, self.num_atomos, self.tipo_dado_id))
+            self.file.close()
+        return self.size
+
+
+class DecodedSlices:
+    # Fatias float16/int8 mapeadas em memória, decodificadas para float32 apenas quando acessadas (stack[i], stack[a:b]),
+    # quem lê em pedaços mantém em memória apenas o pedaço decodificado
+
+    def __init__(self, encoded, tipo_dado_id):
+        self.encoded = encoded
+        self.tipo_dado_id = tipo_dado_id
+        self.shape = encoded.shape
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return len(self.encoded)
+
+    def __getitem__(self, key):
+        return decodeValues(self.encoded[key], self.tipo_dado_id)
+
+    def __array__(self, dtype=None, copy=None):
+        # Decodifica todas as fatias (np.asarray), apenas para quem precisa da pilha inteira
+        return decodeValues(self.encoded, self.tipo_dado_id).astype(dtype or np.float32, copy=False)
+
+
+def readDCCMFile(file_path):
+    # Leitor dos arquivos dccm_data_*.bin: header '<III', nomes dos resíduos (4 bytes cada) e as fatias compactadas
+    # Devolve (nomes, fatias), em float32 as fatias são uma visão do arquivo mapeado em memória,
+    # nas demais codificações um DecodedSlices que decodifica apenas as fatias acessadas
+    data = np.memmap(file_path, dtype=np.uint8, mode='r')
+    num_fatias, num_atomos, tipo_dado_id = struct.unpack_from('<III', data)
+
+    names_block = bytes(data[12:12 + num_atomos * 4])
+    names = [names_block[i:i + 4].rstrip(b'\0').decode('utf-8') for i in range(0, len(names_block), 4)]
+
+    num_elementos_triangulo = num_atomos * (num_atomos + 1) // 2
+    encoded = np.ndarray((num_fatias, num_elementos_triangulo), dtype=ENCODED_DTYPES[tipo_dado_id], buffer=data, offset=12 + num_atomos * 4)
+    return names, (encoded if tipo_dado_id == TIPO_FLOAT32 else DecodedSlices(encoded, tipo_dado_id))
+
+
+def readSparseDCCMFile(file_path):
+    # Leitor dos arquivos dccm_sparse_*.bin (tipo_dado_id 4)
+    # Devolve (nomes, arestas de cada fatia), as arestas são visões do arquivo mapeado em memória
+    data = np.memmap(file_path, dtype=np.uint8, mode='r')
+    num_fatias, num_atomos, tipo_dado_id = struct.unpack_from('<III', data)
+    if tipo_dado_id != TIPO_SPARSE_COO:
+        raise ValueError(f"'{file_path}' não é um arquivo esparso (tipo {tipo_dado_id})")
+
+    names_block = bytes(data[12:12 + num_atomos * 4])
+    names = [names_block[i:i + 4].rstrip(b'\0').decode('utf-8') for i in range(0, len(names_block), 4)]
+
+    offsets_start = 12 + num_atomos * 4
+    offsets = np.frombuffer(data, dtype='<u8', count=num_fatias + 1, offset=offsets_start)
+    edges = np.frombuffer(data, dtype=SPARSE_EDGE_DTYPE, count=int(offsets[-1]), offset=offsets_start + offsets.nbytes)
+    return names, [edges[offsets[i]:offsets[i + 1]] for i in range(num_fatias)]
@@ -0,0 +1,176 @@
+'''
+Codificações dos valores de correlação (tipo_dado_id) e compressão por fatia
+
+tipo_dado_id:
+    1 -> float32 (original)
+    2 -> float16, erro máximo de 2^-11 para valores em [-1, 1]
+    3 -> int8 com escala fixa (valor * 127), erro máximo de 0.5 / 127
+    4 -> lista esparsa de arestas por fatia (i, j, valor), apenas nos arquivos dccm_sparse_*.bin
+
+compressao (apenas no container, cada fatia é comprimida separadamente):
+    0 -> nenhuma
+    1 -> zlib
+    2 -> zstd (necessita do pacote 'zstandard')
+    3 -> delta entre fatias consecutivas + zlib
+    4 -> delta entre fatias consecutivas + zstd
+
+O delta é feito sobre os bits dos valores codificados (aritmética modular), portanto não adiciona erro.
+A cada DELTA_KEYFRAME fatias uma fatia é guardada inteira, limitando quantas fatias são decodificadas para acessar uma.
+'''
+
+import zlib
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TIPO_FLOAT32 = 1
+TIPO_FLOAT16 = 2
+TIPO_INT8 = 3
+TIPO_SPARSE_COO = 4
+
+# Aresta da exportação esparsa, par de resíduos (i < j) e a correlação em float32
+SPARSE_EDGE_DTYPE = np.dtype([('i', '<u2'), ('j', '<u2'), ('value', '<f4')])
+
+ENCODINGS = {'float32': TIPO_FLOAT32, 'float16': TIPO_FLOAT16, 'int8': TIPO_INT8}
+ENCODED_DTYPES = {TIPO_FLOAT32: np.float32, TIPO_FLOAT16: np.float16, TIPO_INT8: np.int8}
+# Inteiros sem sinal do mesmo tamanho, usados no delta
+DELTA_DTYPES = {TIPO_FLOAT32: np.uint32, TIPO_FLOAT16: np.uint16, TIPO_INT8: np.uint8}
+
+INT8_SCALE = 127
+
+COMPRESSIONS = {'none': 0, 'zlib': 1, 'zstd': 2, 'delta-zlib': 3, 'delta-zstd': 4}
+DELTA_KEYFRAME = 16
+
+
+def encodeValues(dados_compactados, tipo_dado_id):
+    # Converte as correlações float32 para a codificação escolhida
+    if tipo_dado_id == TIPO_FLOAT32:
+        return np.asarray(dados_compactados, dtype=np.float32)
+    if tipo_dado_id == TIPO_FLOAT16:
+        return np.asarray(dados_compactados, dtype=np.float16)
+    if tipo_dado_id == TIPO_INT8:
+        return np.rint(np.clip(dados_compactados, -1, 1) * INT8_SCALE).astype(np.int8)
+    raise ValueError(f"Tipo de dado não suportado: {tipo_dado_id}")
+
+
+def decodeValues(encoded, tipo_dado_id):
+    # Decodificador de referência, devolve float32
+    if tipo_dado_id == TIPO_INT8:
+        return np.asarray(encoded, dtype=np.float32) / INT8_SCALE
+    if tipo_dado_id in (TIPO_FLOAT32, TIPO_FLOAT16):
+        return np.asarray(encoded, dtype=np.float32)
+    raise ValueError(f"Tipo de dado não suportado: {tipo_dado_id}")
+
+
+def usesDelta(compressao):
+    return compressao in (3, 4)
+
+
+def compressionAvailable(compressao):
+    # zstd (2 e 4) depende do pacote opcional 'zstandard'
+    return compressao not in (2, 4) or zstandard is not None
+
+
+def compressBytes(data, compressao):
+    if compressao == 0:
+        return data
+    if compressao in (1, 3):
+        return zlib.compress(data, 6)
+    if compressao in (2, 4):
+        if zstandard is None:
+            raise ImportError("Compressão zstd necessita do pacote 'zstandard' (pip install zstandard)")
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    raise ValueError(f"Compressão não suportada: {compressao}")
+
+
+def decompressBytes(data, compressao):
+    if compressao == 0:
+        return data
+    if compressao in (1, 3):
+        return zlib.decompress(data)
+    if compressao in (2, 4):
+        if zstandard is None:
+            raise ImportError("Compressão zstd necessita do pacote 'zstandard' (pip install zstandard)")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Compressão não suportada: {compressao}")
+
+
+def encodeSlices(dados_compactados, tipo_dado_id, compressao, keyframe=DELTA_KEYFRAME):
+    # Codifica e comprime cada fatia separadamente, devolvendo uma lista de bytes (uma entrada do índice do container por fatia)
+    encoded = encodeValues(dados_compactados, tipo_dado_id)
+    if compressao == 0:
+        return list(encoded)
+
+    delta_dtype = DELTA_DTYPES[tipo_dado_id]
+    slices = []
+    for i in range(len(encoded)):
+        fatia = encoded[i]
+        if usesDelta(compressao) and i % keyframe != 0:
+            # Diferença modular entre os bits desta fatia e da anterior
+            fatia = encoded[i].view(delta_dtype) - encoded[i - 1].view(delta_dtype)
+        slices.append(compressBytes(fatia.tobytes(), compressao))
+    return slices
+
+
+def decodeSlice(read_raw, index, num_elementos_triangulo, tipo_dado_id, compressao, keyframe=DELTA_KEYFRAME):
+    # Decodificador de referência de uma fatia, 'read_raw(i)' devolve os bytes da fatia i como estão no arquivo
+    dtype = ENCODED_DTYPES[tipo_dado_id]
+    if not usesDelta(compressao):
+        raw = decompressBytes(bytes(read_raw(index)), compressao)
+        return decodeValues(np.frombuffer(raw, dtype=dtype, count=num_elementos_triangulo), tipo_dado_id)
+
+    # Com delta, soma as diferenças desde a última fatia completa (keyframe)
+    delta_dtype = DELTA_DTYPES[tipo_dado_id]
+    bits = np.zeros(num_elementos_triangulo, dtype=delta_dtype)
+    for i in range(index - index % keyframe, index + 1):
+        bits += np.frombuffer(decompressBytes(bytes(read_raw(i)), compressao), dtype=delta_dtype, count=num_elementos_triangulo)
+    return decodeValues(bits.view(dtype), tipo_dado_id)
+
+
+def reportEncoding(dados_compactados, tipo_dado_id, compressao=0):
+    # Erro de quantização e razão de compressão em relação ao float32 original
+    encoded_slices = encodeSlices(dados_compactados, tipo_dado_id, compressao)
+    decoded = decodeValues(encodeValues(dados_compactados, tipo_dado_id), tipo_dado_id)
+    error = np.abs(decoded - dados_compactados)
+
+    tamanho_original = dados_compactados.size * 4
+    tamanho_codificado = sum(memoryview(fatia).nbytes for fatia in encoded_slices)
+    return {
+        'tipo_dado_id': tipo_dado_id,
+        'compressao': compressao,
+        'erro_maximo': float(error.max()) if error.size else 0.0,
+        'erro_rms': float(np.sqrt(np.mean(np.square(error, dtype=np.float64)))) if error.size else 0.0,
+        'tamanho_original': tamanho_original,
+        'tamanho_codificado': tamanho_codificado,
+        'razao': tamanho_original / tamanho_codificado if tamanho_codificado else 0.0,
+    }
+
+
+def main() -> int:
+    # Relatório de erro e razão de compressão de cada codificação para arquivos dccm_data_*.bin já gerados
+    import sys
+    from dccm_container import readDCCMFile
+
+    if len(sys.argv) < 2:
+        print("Uso: python dccm_encoding.py dccm_data_<janela>.bin [...]")
+        return 1
+
+    for file_path in sys.argv[1:]:
+        # O relatório compara cada codificação com a pilha inteira em float32
+        dados_compactados = np.asarray(readDCCMFile(file_path)[1])
+        print(file_path)
+        print(f"{'tipo':>8} {'compressao':>11} {'erro max':>10} {'erro rms':>10} {'KB':>10} {'razao':>7}")
+        for encoding, tipo_dado_id in ENCODINGS.items():
+            for compression, compressao in COMPRESSIONS.items():
+                if not compressionAvailable(compressao):
+                    continue
+                report = reportEncoding(dados_compactados, tipo_dado_id, compressao)
+                print(f"{encoding:>8} {compression:>11} {report['erro_maximo']:>10.2e} {report['erro_rms']:>10.2e} "
+                      f"{report['tamanho_codificado'] / 1024:>10.1f} {report['razao']:>6.2f}x")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
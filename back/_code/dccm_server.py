@@ -0,0 +1,291 @@
+'''
+Servidor HTTP local que calcula as fatias de DCCM sob demanda, para qualquer janela
+
+As coordenadas alinhadas de cada réplica vêm do cache aligned_CA.npy (gerado na primeira requisição, ver cachedXTCandGRO)
+e cada fatia é calculada apenas quando pedida, guardada em um LRU limitado em bytes. Requisições simultâneas para a
+mesma fatia são agrupadas, a fatia é calculada uma única vez.
+
+Rotas (respostas binárias no mesmo formato dos dccm_data_*.bin: header '<III', nomes e triângulos compactados float32):
+    GET /systems                                         -> JSON {sistema: [réplicas]}
+    GET /info/<sistema>/<réplica>                        -> JSON com frames, átomos e nomes dos resíduos
+    GET /dccm/<sistema>/<réplica>/<janela>.bin           -> todas as fatias da janela (equivalente ao dccm_data_<janela>.bin)
+    GET /dccm/<sistema>/<réplica>/<janela>/<fatia>.bin   -> apenas uma fatia (num_fatias = 1)
+    GET /tile/<sistema>/<réplica>/<janela>/<fatia>?row=0&col=0&size=256
+                                                         -> bloco da matriz N×N em float32 (linha a linha),
+                                                            posição e tamanho nos headers X-Tile-*
+'''
+
+import os
+import sys
+import json
+import struct
+import argparse
+import threading
+import collections
+import concurrent.futures
+import urllib.parse
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from transformer_num import dataTranformer, listReplicas, domainRange, BACKENDS, COARSE_GRAIN_MODES, WEIGHTING_MODES
+from dccm_container import encodeNames
+
+
+class LRUCache:
+    # Cache de arrays limitado pela soma de bytes, descarta os menos usados recentemente
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            if value.nbytes > self.max_bytes:
+                return
+            if key in self.entries:
+                self.size -= self.entries.pop(key).nbytes
+            self.entries[key] = value
+            self.size += value.nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+
+class RequestCoalescer:
+    # Agrupa chamadas simultâneas com a mesma chave, apenas a primeira executa e as demais esperam o resultado
+
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def run(self, key, function):
+        with self.lock:
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self.pending[key] = future
+        if not owner:
+            return future.result()
+
+        try:
+            result = function()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+
+
+class DCCMService:
+
+    def __init__(self, data_path, max_cache_mb=512, backend=None, trajectory_file='traj_CA.xtc', topology_file='protein_CA_only.gro',
+                 input_options=None):
+        self.app = dataTranformer(backend)
+        self.trajectory_file = trajectory_file
+        self.topology_file = topology_file
+        self.input_options = input_options or {}
+        self.app.algs.input_settings = self.app.algs.inputSettings(trajectory_file, topology_file, self.input_options)
+
+        # Apenas réplicas presentes nos dados podem ser pedidas (os nomes nunca são usados diretamente como caminhos)
+        self.replicas = {(system, replica): path for system, replica, path in listReplicas(data_path)}
+        self.trajectories = {}
+        self.slices = LRUCache(max_cache_mb * 1024 * 1024)
+        self.coalescer = RequestCoalescer()
+
+    def systems(self):
+        systems = collections.defaultdict(list)
+        for system, replica in sorted(self.replicas):
+            systems[system].append(replica)
+        return dict(systems)
+
+    def trajectory(self, system, replica):
+        # Coordenadas alinhadas (mapeadas em memória) e nomes de uma réplica, carregadas uma única vez
+        key = (system, replica)
+        if key not in self.replicas:
+            raise KeyError(f"Réplica desconhecida: {system}/{replica}")
+        if key not in self.trajectories:
+            self.trajectories[key] = self.coalescer.run(('trajectory',) + key, lambda: self.loadTrajectory(self.replicas[key]))
+        return self.trajectories[key]
+
+    def loadTrajectory(self, path):
+        cache = self.app.cache
+        trajectory_path = os.path.join(path, self.trajectory_file)
+        gro_path = os.path.join(path, self.topology_file)
+        manifest = cache.loadManifest(path)
+        input_digests = cache.inputDigests(manifest, {self.trajectory_file: trajectory_path, self.topology_file: gro_path})
+        loadFrames = self.app.algs.cachedXTCandGRO(path, trajectory_path, gro_path, manifest, input_digests, input_options=self.input_options)
+        return loadFrames()
+
+    def slice(self, system, replica, window, index):
+        # Triângulo superior compactado (num_elementos_triangulo,) de uma fatia
+        key = (system, replica, window, index)
+        packed = self.slices.get(key)
+        if packed is None:
+            packed = self.coalescer.run(key, lambda: self.computeSlice(*key))
+        return packed
+
+    def computeSlice(self, system, replica, window, index):
+        xyz, _ = self.trajectory(system, replica)
+        if window <= 0 or not 0 <= index < len(xyz) // window:
+            raise IndexError(f"Fatia {index} fora da trajetória para a janela de {window} frames")
+        frames = np.asarray(xyz[index * window:(index + 1) * window])
+        packed = self.app.algs.calculateDCCMpacked(frames[None])[0]
+        self.slices.put((system, replica, window, index), packed)
+        return packed
+
+    def window(self, system, replica, window):
+        # Todas as fatias de uma janela, as que não estão no cache são calculadas juntas em um único lote
+        if window <= 0:
+            raise ValueError(f"Janela inválida: {window}")
+        return self.coalescer.run((system, replica, window), lambda: self.computeWindow(system, replica, window))
+
+    def computeWindow(self, system, replica, window):
+        xyz, names = self.trajectory(system, replica)
+        n_slices = len(xyz) // window
+        packed = np.empty((n_slices, len(names) * (len(names) + 1) // 2), dtype=np.float32)
+        missing = []
+        for index in range(n_slices):
+            cached = self.slices.get((system, replica, window, index))
+            if cached is None:
+                missing.append(index)
+            else:
+                packed[index] = cached
+
+        if missing:
+            sliced = self.app.algs.slicedTrajectory(np.asarray(xyz[:n_slices * window]), window)
+            packed[missing] = self.app.algs.calculateDCCMpacked(sliced[missing])
+            for index in missing:
+                self.slices.put((system, replica, window, index), packed[index].copy())
+        return packed
+
+    def dccmBytes(self, system, replica, dados_compactados):
+        # Mesmo layout dos arquivos dccm_data_*.bin
+        _, names = self.trajectory(system, replica)
+        encoded_names = encodeNames(names)
+        header = struct.pack('<III', len(dados_compactados), len(names), 1)
+        return header + encoded_names + np.ascontiguousarray(dados_compactados, dtype=np.float32).tobytes()
+
+    def tile(self, system, replica, window, index, row, col, size):
+        # Bloco [row:row+size, col:col+size] da matriz simétrica, reconstruído do triângulo compactado
+        _, names = self.trajectory(system, replica)
+        n_atoms = len(names)
+        if not (0 <= row < n_atoms and 0 <= col < n_atoms):
+            raise ValueError(f"Bloco ({row}, {col}) fora da matriz de {n_atoms} resíduos")
+        if size <= 0:
+            raise ValueError(f"Tamanho de bloco inválido: {size}")
+        packed = self.slice(system, replica, window, index)
+        rows = np.arange(row, min(row + size, n_atoms))[:, None]
+        cols = np.arange(col, min(col + size, n_atoms))[None, :]
+        first, second = np.minimum(rows, cols), np.maximum(rows, cols)
+        return packed[first * n_atoms - (first * (first - 1)) // 2 + (second - first)]
+
+
+class DCCMRequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        parts = [urllib.parse.unquote(part) for part in url.path.strip('/').split('/') if part]
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            if parts == ['systems']:
+                return self.sendJSON(self.service.systems())
+            if len(parts) == 3 and parts[0] == 'info':
+                xyz, names = self.service.trajectory(parts[1], parts[2])
+                return self.sendJSON({'frames': len(xyz), 'atoms': len(names), 'names': names})
+            if len(parts) == 4 and parts[0] == 'dccm' and parts[3].endswith('.bin'):
+                system, replica, window = parts[1], parts[2], int(parts[3][:-4])
+                return self.sendBinary(self.service.dccmBytes(system, replica, self.service.window(system, replica, window)))
+            if len(parts) == 5 and parts[0] == 'dccm' and parts[4].endswith('.bin'):
+                system, replica, window, index = parts[1], parts[2], int(parts[3]), int(parts[4][:-4])
+                return self.sendBinary(self.service.dccmBytes(system, replica, self.service.slice(system, replica, window, index)[None]))
+            if len(parts) == 5 and parts[0] == 'tile':
+                system, replica, window, index = parts[1], parts[2], int(parts[3]), int(parts[4])
+                row, col, size = (int(query.get(name, [default])[0]) for name, default in (('row', 0), ('col', 0), ('size', 256)))
+                tile = self.service.tile(system, replica, window, index, row, col, size)
+                return self.sendBinary(np.ascontiguousarray(tile, dtype=np.float32).tobytes(),
+                                       {'X-Tile-Row': row, 'X-Tile-Col': col, 'X-Tile-Rows': tile.shape[0], 'X-Tile-Cols': tile.shape[1]})
+            self.sendError(404, 'Rota desconhecida')
+        except KeyError as e:
+            self.sendError(404, e.args[0])
+        except IndexError as e:
+            self.sendError(404, str(e))
+        except ValueError as e:
+            self.sendError(400, str(e))
+        except (BrokenPipeError, ConnectionResetError):
+            # O cliente fechou a conexão durante a resposta
+            return
+        except Exception as e:
+            # Erros ao ler ou calcular (ex: XTC ausente) também recebem resposta, ao invés de derrubar a conexão
+            self.log_error('%s', f'{type(e).__name__}: {e}')
+            self.sendError(500, f'{type(e).__name__}: {e}')
+
+    def sendHeaders(self, status, content_type, length, extra=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(length))
+        # O frontend (vite) roda em outra porta
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Expose-Headers', 'X-Tile-Row, X-Tile-Col, X-Tile-Rows, X-Tile-Cols')
+        for name, value in (extra or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+
+    def sendBinary(self, data, extra=None):
+        self.sendHeaders(200, 'application/octet-stream', len(data), extra)
+        self.wfile.write(data)
+
+    def sendJSON(self, value):
+        data = json.dumps(value).encode('utf-8')
+        self.sendHeaders(200, 'application/json', len(data))
+        self.wfile.write(data)
+
+    def sendError(self, status, message):
+        data = json.dumps({'erro': message}).encode('utf-8')
+        self.sendHeaders(status, 'application/json', len(data))
+        self.wfile.write(data)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Servidor local de fatias de DCCM calculadas sob demanda')
+    parser.add_argument('--data', default='../dados', help='Pasta com os sistemas e réplicas')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-mb', type=int, default=512, help='Tamanho máximo do LRU de fatias, em MB')
+    parser.add_argument('--backend', choices=['auto'] + sorted(BACKENDS), default='numpy', help='Backend de arrays dos kernels')
+    parser.add_argument('--trajectory-file', default='traj_CA.xtc')
+    parser.add_argument('--topology-file', default='protein_CA_only.gro')
+    parser.add_argument('--selection', default=None)
+    parser.add_argument('--coarse-grain', choices=COARSE_GRAIN_MODES, default='atom')
+    parser.add_argument('--weighting', choices=WEIGHTING_MODES, default='centroid')
+    parser.add_argument('--domains', nargs='+', type=domainRange, default=None, metavar='NOME:INICIO-FIM')
+    args = parser.parse_args()
+
+    input_options = {'selection': args.selection, 'coarse_grain': args.coarse_grain, 'weighting': args.weighting, 'domains': args.domains}
+    DCCMRequestHandler.service = DCCMService(args.data, args.cache_mb, args.backend, args.trajectory_file, args.topology_file, input_options)
+
+    server = ThreadingHTTPServer((args.host, args.port), DCCMRequestHandler)
+    print(f"Servidor de DCCM em http://{args.host}:{args.port} ({len(DCCMRequestHandler.service.replicas)} réplicas)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+'''
+DCCM diferencial entre pares de sistemas (ex: mutante contra wt, sistema com ligante contra o mesmo sem ligante)
+
+Para cada par A:B e cada janela, escreve em <dados>/Differential/<A>_vs_<B> no mesmo formato binário dos dccm_data_*.bin:
+    dccm_delta_{janela}.bin  -> média das réplicas de A menos a média das réplicas de B
+    dccm_tstat_{janela}.bin  -> estatística t de Welch de cada par de resíduos entre as réplicas de A e de B
+
+A pasta Differential não possui réplicas (Rep_*), portanto é ignorada pelo pré-processamento.
+'''
+
+import os
+import numpy as np
+
+from ensemble import openDCCMOutputs
+
+DIFFERENTIAL_FOLDER = 'Differential'
+REFERENCE_SYSTEM = 'wt'
+LIGAND_SUFFIX = '_lig'
+
+
+def defaultPairs(systems):
+    # Sistema com ligante contra o mesmo sem ligante e cada mutante contra o wt (com e sem ligante)
+    systems = set(systems)
+    pairs = []
+    for system in sorted(systems):
+        if system.endswith(LIGAND_SUFFIX) and system[:-len(LIGAND_SUFFIX)] in systems:
+            pairs.append((system, system[:-len(LIGAND_SUFFIX)]))
+    for system in sorted(systems):
+        base = system[:-len(LIGAND_SUFFIX)] if system.endswith(LIGAND_SUFFIX) else system
+        reference = REFERENCE_SYSTEM + system[len(base):]
+        if base != REFERENCE_SYSTEM and reference in systems:
+            pairs.append((system, reference))
+    return pairs
+
+
+class Differential:
+
+    def __init__(self, parent):
+        self.utils = parent
+
+    def diagonalMask(self, n_atoms):
+        # Posições da diagonal no triângulo compactado
+        rows, cols = np.triu_indices(n_atoms)
+        return rows == cols
+
+    def welchT(self, count_a, mean_a, m2_a, count_b, mean_b, m2_b, diagonal=None):
+        # Estatística t de Welch, zero onde não há variância entre as réplicas (ou menos de 2 réplicas em um dos lados)
+        if count_a < 2 or count_b < 2:
+            return np.zeros_like(mean_a)
+        standard_error = np.sqrt(m2_a / ((count_a - 1) * count_a) + m2_b / ((count_b - 1) * count_b))
+        t = np.zeros_like(mean_a)
+        np.divide(mean_a - mean_b, standard_error, out=t, where=standard_error > 0)
+        if diagonal is not None:
+            # A diagonal é 1 em todas as réplicas, a variância ali é apenas arredondamento do float32 e o t seria ruído
+            t[..., diagonal] = 0
+        return t
+
+    def comparePair(self, data_path, system_a, system_b, slice_sizes, chunk_slices=64):
+        output_path = os.path.join(data_path, DIFFERENTIAL_FOLDER, f'{system_a}_vs_{system_b}')
+
+        for slice_size in slice_sizes:
+            names_a, stacks_a = self.utils.ensemble.replicaStacks(os.path.join(data_path, system_a), slice_size)
+            names_b, stacks_b = self.utils.ensemble.replicaStacks(os.path.join(data_path, system_b), slice_size)
+            if not stacks_a or not stacks_b:
+                continue
+            if names_a != names_b:
+                print(f"Resíduos de '{system_a}' e '{system_b}' diferem, janela {slice_size} ignorada")
+                continue
+
+            # Apenas as fatias presentes em todas as réplicas dos dois sistemas
+            num_fatias = min(len(stack) for stack in stacks_a + stacks_b)
+            os.makedirs(output_path, exist_ok=True)
+            outputs = {kind: os.path.join(output_path, f'dccm_{kind}_{slice_size}.bin') for kind in ('delta', 'tstat')}
+            files = openDCCMOutputs(outputs, num_fatias, names_a)
+            diagonal = self.diagonalMask(len(names_a))
+            try:
+                # Cada pedaço de fatias é calculado de uma vez para todos os pares de resíduos do triângulo compactado
+                for start in range(0, num_fatias, chunk_slices):
+                    stop = min(start + chunk_slices, num_fatias)
+                    count_a, mean_a, m2_a, _ = self.utils.ensemble.welfordChunk(stacks_a, start, stop)
+                    count_b, mean_b, m2_b, _ = self.utils.ensemble.welfordChunk(stacks_b, start, stop)
+                    files['delta'].write((mean_a - mean_b).astype(np.float32).tobytes())
+                    files['tstat'].write(self.welchT(count_a, mean_a, m2_a, count_b, mean_b, m2_b, diagonal).astype(np.float32).tobytes())
+            finally:
+                for f in files.values():
+                    f.close()
+
+            print(f"Diferencial {system_a} - {system_b} salvo em '{output_path}' (janela {slice_size}, {num_fatias} fatias)")
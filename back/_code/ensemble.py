@@ -0,0 +1,98 @@
+'''
+Agregação das réplicas de cada sistema (média, desvio padrão e concordância de sinal das correlações)
+
+Executado após o processamento de cada réplica, lê os arquivos dccm_data_*.bin das réplicas (mapeados em memória)
+e escreve em <sistema>/Ensemble os arquivos no mesmo formato binário:
+    dccm_mean_{janela}.bin  -> média das réplicas
+    dccm_std_{janela}.bin   -> desvio padrão amostral das réplicas
+    dccm_sign_{janela}.bin  -> concordância de sinal, (réplicas positivas - réplicas negativas) / réplicas, em [-1, 1]
+'''
+
+import os
+import struct
+import numpy as np
+
+from dccm_container import readDCCMFile, encodeNames
+
+ENSEMBLE_FOLDER = 'Ensemble'
+
+
+def openDCCMOutputs(outputs, num_fatias, names):
+    # Abre os arquivos .bin {tipo: caminho} já com header e nomes, as fatias float32 são escritas depois, em pedaços
+    encoded_names = encodeNames(names)
+    files = {}
+    for kind, file_path in outputs.items():
+        files[kind] = open(file_path, 'wb')
+        files[kind].write(struct.pack('<III', num_fatias, len(names), 1))
+        files[kind].write(encoded_names)
+    return files
+
+
+class Ensemble:
+
+    def __init__(self, parent):
+        self.utils = parent
+
+    def replicaStacks(self, system_path, slice_size):
+        # Fatias de cada réplica para uma janela, apenas réplicas que já possuem o arquivo
+        names = None
+        stacks = []
+        for replica in sorted(r for r in os.listdir(system_path) if r.startswith('Rep_')):
+            file_path = os.path.join(system_path, replica, f'dccm_data_{slice_size}.bin')
+            if not os.path.exists(file_path):
+                continue
+            replica_names, stack = readDCCMFile(file_path)
+            if names is not None and replica_names != names:
+                raise ValueError(f"Resíduos de '{file_path}' diferem das outras réplicas")
+            names = replica_names
+            stacks.append(stack)
+        return names, stacks
+
+    def welfordChunk(self, stacks, start, stop):
+        # Média e soma dos quadrados dos desvios (M2) das réplicas para as fatias [start, stop),
+        # atualizadas uma réplica por vez (Welford), apenas um pedaço de cada réplica é lido por vez
+        count = 0
+        mean = None
+        m2 = None
+        sign = None
+        for stack in stacks:
+            values = np.asarray(stack[start:stop], dtype=np.float64)
+            count += 1
+            if mean is None:
+                mean = values.copy()
+                m2 = np.zeros_like(values)
+                sign = np.zeros(values.shape, dtype=np.int32)
+            else:
+                delta = values - mean
+                mean += delta / count
+                m2 += delta * (values - mean)
+            sign += np.sign(values).astype(np.int32)
+        return count, mean, m2, sign
+
+    def aggregateSystem(self, system_path, slice_sizes, chunk_slices=64):
+        output_path = os.path.join(system_path, ENSEMBLE_FOLDER)
+        os.makedirs(output_path, exist_ok=True)
+
+        for slice_size in slice_sizes:
+            names, stacks = self.replicaStacks(system_path, slice_size)
+            if not stacks:
+                continue
+
+            # Réplicas de tamanhos diferentes são comparadas apenas nas fatias em comum
+            num_fatias = min(len(stack) for stack in stacks)
+            outputs = {kind: os.path.join(output_path, f'dccm_{kind}_{slice_size}.bin') for kind in ('mean', 'std', 'sign')}
+            files = openDCCMOutputs(outputs, num_fatias, names)
+            try:
+                # Cada pedaço de fatias é agregado e escrito antes do próximo
+                for start in range(0, num_fatias, chunk_slices):
+                    stop = min(start + chunk_slices, num_fatias)
+                    count, mean, m2, sign = self.welfordChunk(stacks, start, stop)
+                    std = np.sqrt(m2 / (count - 1)) if count > 1 else np.zeros_like(m2)
+                    files['mean'].write(mean.astype(np.float32).tobytes())
+                    files['std'].write(std.astype(np.float32).tobytes())
+                    files['sign'].write((sign / count).astype(np.float32).tobytes())
+            finally:
+                for f in files.values():
+                    f.close()
+
+            print(f"Ensemble de {len(stacks)} réplicas salvo em '{output_path}' (janela {slice_size}, {num_fatias} fatias)")
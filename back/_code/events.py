@@ -0,0 +1,125 @@
+'''
+Índice de eventos da série temporal de DCCMs (onde as correlações aparecem e desaparecem)
+
+Para cada arquivo dccm_data_*.bin, lido em pedaços de fatias (mapeado em memória), calcula a distância de Frobenius
+de cada fatia para a fatia anterior e para a média de todas as fatias. As mudanças bruscas (pontos de mudança) são as
+fatias cuja distância para a anterior tem z-score robusto (mediana e MAD) acima do limiar e é um máximo local.
+
+O índice é escrito ao lado do .bin, ex: dccm_data_100.bin -> dccm_data_100_events.json, com as distâncias de todas
+as fatias e, para cada evento, a fatia, as distâncias e os pares de resíduos que mais mudaram em relação à fatia anterior.
+'''
+
+import os
+import glob
+import json
+import numpy as np
+
+from dccm_container import readDCCMFile
+
+EVENTS_SUFFIX = '_events.json'
+
+# Fator que torna o MAD comparável ao desvio padrão de uma distribuição normal
+MAD_SCALE = 1.4826
+
+# Número mínimo de fatias para procurar pontos de mudança
+MIN_SLICES = 5
+
+
+def robustZScore(values):
+    # (x - mediana) / (1.4826 * MAD), zero quando não há dispersão
+    median = np.median(values)
+    mad = MAD_SCALE * np.median(np.abs(values - median))
+    if mad == 0:
+        return np.zeros_like(values)
+    return (values - median) / mad
+
+
+class Events:
+
+    def __init__(self, parent):
+        self.utils = parent
+
+    def frobeniusWeights(self, n_atoms):
+        # Peso de cada elemento do triângulo compactado na norma da matriz inteira, 1 na diagonal e 2 fora dela
+        rows, cols = np.triu_indices(n_atoms)
+        return np.where(rows == cols, 1.0, 2.0)
+
+    def sliceDistances(self, stack, n_atoms, chunk_slices=256):
+        # Primeira passada: média de todas as fatias, segunda passada: distâncias para a anterior e para a média
+        num_fatias = len(stack)
+        weights = self.frobeniusWeights(n_atoms)
+
+        mean = np.zeros(stack.shape[1])
+        for start in range(0, num_fatias, chunk_slices):
+            mean += np.asarray(stack[start:start + chunk_slices], dtype=np.float64).sum(axis=0)
+        mean /= max(num_fatias, 1)
+
+        to_previous = np.zeros(num_fatias)
+        to_mean = np.zeros(num_fatias)
+        previous = None
+        for start in range(0, num_fatias, chunk_slices):
+            chunk = np.asarray(stack[start:start + chunk_slices], dtype=np.float64)
+            # A última fatia do pedaço anterior é a referência da primeira fatia deste
+            shifted = np.concatenate([chunk[:1] if previous is None else previous[None], chunk[:-1]])
+            to_previous[start:start + len(chunk)] = np.sqrt(((chunk - shifted) ** 2) @ weights)
+            to_mean[start:start + len(chunk)] = np.sqrt(((chunk - mean) ** 2) @ weights)
+            previous = chunk[-1]
+        return to_previous, to_mean
+
+    def changePoints(self, to_previous, threshold=3.5):
+        # Fatias com z-score robusto acima do limiar que também são máximos locais, evitando vários eventos por transição
+        # A primeira fatia não possui anterior e fica fora da estatística, com poucas fatias a mediana e o MAD não são confiáveis
+        zscores = np.zeros_like(to_previous)
+        if len(to_previous) < MIN_SLICES:
+            return [], zscores
+        zscores[1:] = robustZScore(to_previous[1:])
+        events = []
+        for s in range(1, len(to_previous)):
+            neighbours = to_previous[max(s - 1, 1):s + 2]
+            if zscores[s] >= threshold and to_previous[s] == neighbours.max():
+                events.append(s)
+        return events, zscores
+
+    def topChangedPairs(self, before, after, names, top_pairs=10):
+        # Pares de resíduos (i < j) com a maior mudança absoluta entre duas fatias compactadas
+        n_atoms = len(names)
+        rows, cols = np.triu_indices(n_atoms)
+        off_diagonal = np.flatnonzero(rows != cols)
+        delta = after[off_diagonal].astype(np.float64) - before[off_diagonal]
+        top = off_diagonal[np.argsort(-np.abs(delta))[:top_pairs]]
+        return [{'i': int(rows[p]), 'j': int(cols[p]), 'residues': [names[rows[p]], names[cols[p]]],
+                 'before': round(float(before[p]), 4), 'after': round(float(after[p]), 4),
+                 'delta': round(float(after[p]) - float(before[p]), 4)} for p in top]
+
+    def indexFile(self, file_path, threshold=3.5, top_pairs=10):
+        # Escreve o índice de eventos ao lado do .bin e devolve o caminho do índice
+        names, stack = readDCCMFile(file_path)
+        to_previous, to_mean = self.sliceDistances(stack, len(names))
+        events, zscores = self.changePoints(to_previous, threshold)
+        mean_zscores = robustZScore(to_mean) if len(to_mean) > 0 else to_mean
+
+        index = {
+            'source': os.path.basename(file_path),
+            'num_fatias': len(stack),
+            'num_atomos': len(names),
+            'threshold': threshold,
+            'distance_to_previous': [round(float(value), 5) for value in to_previous],
+            'distance_to_mean': [round(float(value), 5) for value in to_mean],
+            'events': [{'slice': s,
+                        'distance_to_previous': round(float(to_previous[s]), 5),
+                        'zscore': round(float(zscores[s]), 3),
+                        'distance_to_mean': round(float(to_mean[s]), 5),
+                        'zscore_to_mean': round(float(mean_zscores[s]), 3),
+                        'pairs': self.topChangedPairs(stack[s - 1], stack[s], names, top_pairs)} for s in events],
+        }
+        index_path = file_path[:-len('.bin')] + EVENTS_SUFFIX
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+
+        print(f"Índice de eventos '{index_path}' salvo com sucesso! ({len(events)} eventos em {len(stack)} fatias)")
+        return index_path
+
+    def indexReplica(self, replica_path, threshold=3.5, top_pairs=10):
+        # Todas as janelas da réplica, inclusive as deslizantes (dccm_data_{janela}_stride_{passo}.bin)
+        return [self.indexFile(file_path, threshold, top_pairs)
+                for file_path in sorted(glob.glob(os.path.join(replica_path, 'dccm_data_*.bin')))]
@@ -0,0 +1,225 @@
+'''
+Instrumentação por etapa do pré-processamento (leitura, alinhamento, momentos, DCCM, codificação e escrita)
+
+Cada etapa gera uma linha JSON (JSON-lines) com o tempo de parede, tempo de CPU e memória, além do sistema,
+réplica e janela. Vários processos podem escrever no mesmo arquivo, cada linha é escrita de uma vez em modo append.
+
+Ganchos opcionais (profile):
+    'tracemalloc' -> pico de memória alocada na etapa e as linhas que mais alocaram
+    'cprofile'    -> um arquivo .prof por etapa (abrir com python -m pstats ou snakeviz)
+'''
+
+import os
+import sys
+import json
+import time
+import socket
+import cProfile
+import contextlib
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Sem getrusage fora de sistemas Unix
+    resource = None
+
+PROFILE_MODES = ['cprofile', 'tracemalloc']
+
+
+def residentMemory():
+    # Memória residente atual do processo (MB), None quando não disponível
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peakResidentMemory():
+    # Maior memória residente do processo até agora (MB), o ru_maxrss é em KB no Linux e em bytes no macOS
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def residentHighWaterMark():
+    # Pico de memória residente desde o último resetResidentHighWaterMark (VmHWM, MB), None fora do Linux
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def resetResidentHighWaterMark():
+    # Reinicia o VmHWM do processo (Linux), devolve False quando não é possível
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class Instrumentation:
+
+    def __init__(self, parent, log_path=None, profile=None, profile_dir=None):
+        self.utils = parent
+        self.log_path = log_path
+        self.profile = profile
+        self.profile_dir = profile_dir or (os.path.dirname(os.path.abspath(log_path)) if log_path else '.')
+        self.context = {}
+        # Etapas podem ser aninhadas (ex: 'job' contém as demais), o cProfile é usado apenas na etapa mais externa que o pediu
+        # e o pico do tracemalloc de cada nível é combinado com o das etapas internas
+        self.profiling = False
+        self.traced_peaks = []
+        # Mesmo esquema para o pico de memória residente de cada etapa, quando o VmHWM pode ser reiniciado (Linux),
+        # caso contrário o rss_peak_mb é o pico do processo inteiro (rss_peak_scope 'process')
+        self.rss_peaks = []
+        self.stage_rss_peak = self.enabled and resetResidentHighWaterMark() and residentHighWaterMark() is not None
+        # Tempo somado dos trechos repetidos de cada etapa e campos (ver accumulate)
+        self.accumulated = {}
+        if profile is not None and profile not in PROFILE_MODES:
+            raise ValueError(f"Modo de profile desconhecido: {profile} (disponíveis: {', '.join(PROFILE_MODES)})")
+
+    @property
+    def enabled(self):
+        return self.log_path is not None or self.profile is not None
+
+    def setContext(self, **fields):
+        # Campos repetidos em todas as linhas seguintes (ex: sistema e réplica)
+        self.context = dict(fields)
+
+    @contextlib.contextmanager
+    def stage(self, name, profile=True, **fields):
+        # Mede uma etapa, o dicionário devolvido pode receber campos extras (ex: bytes escritos, número de fatias)
+        # profile=False desativa o gancho de profile nesta etapa (ex: etapas que apenas agrupam outras)
+        record = dict(self.context, stage=name, **fields)
+        if not self.enabled:
+            yield record
+            return
+
+        profiler = None
+        if self.profile == 'cprofile' and profile and not self.profiling:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            self.profiling = True
+        tracing = self.profile == 'tracemalloc' and profile
+        started_tracemalloc = False
+        if tracing:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracemalloc = True
+            self.pushTracedPeak()
+            snapshot_start = tracemalloc.take_snapshot()
+        if self.stage_rss_peak:
+            self.pushResidentPeak()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        status = 'ok'
+        try:
+            yield record
+        except BaseException as e:
+            status = f'erro: {type(e).__name__}: {e}'
+            raise
+        finally:
+            record['wall_s'] = time.perf_counter() - wall_start
+            record['cpu_s'] = time.process_time() - cpu_start
+            record['rss_mb'] = residentMemory()
+            if self.stage_rss_peak:
+                record['rss_peak_mb'] = self.popResidentPeak()
+                record['rss_peak_scope'] = 'stage'
+            else:
+                record['rss_peak_mb'] = peakResidentMemory()
+                record['rss_peak_scope'] = 'process'
+            record['status'] = status
+
+            if profiler is not None:
+                profiler.disable()
+                self.profiling = False
+                record['profile_path'] = self.dumpProfile(profiler, record)
+            if tracing:
+                record['traced_peak_mb'] = self.popTracedPeak() / (1024 * 1024)
+                top = tracemalloc.take_snapshot().compare_to(snapshot_start, 'lineno')[:5]
+                record['top_allocations'] = [str(stat) for stat in top]
+                if started_tracemalloc:
+                    tracemalloc.stop()
+            self.emit(record)
+
+    @contextlib.contextmanager
+    def accumulate(self, name, **fields):
+        # Soma o tempo de parede e de CPU de um trecho executado várias vezes (ex: a DCCM de cada lote de uma janela),
+        # flushAccumulated emite uma única linha por etapa e campos, com o total e o número de chamadas
+        if not self.enabled:
+            yield
+            return
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            totals = self.accumulated.setdefault((name, tuple(sorted(fields.items()))), {'wall_s': 0.0, 'cpu_s': 0.0, 'calls': 0})
+            totals['wall_s'] += time.perf_counter() - wall_start
+            totals['cpu_s'] += time.process_time() - cpu_start
+            totals['calls'] += 1
+
+    def flushAccumulated(self):
+        # Emite os totais acumulados desde a última chamada, com o contexto atual (sistema e réplica)
+        for (name, fields), totals in self.accumulated.items():
+            self.emit(dict(self.context, stage=name, **dict(fields), **totals, rss_mb=residentMemory(), status='ok'))
+        self.accumulated = {}
+
+    def pushTracedPeak(self):
+        # Guarda o pico da etapa externa até agora e reinicia a contagem para a nova etapa
+        if self.traced_peaks:
+            self.traced_peaks[-1] = max(self.traced_peaks[-1], tracemalloc.get_traced_memory()[1])
+        self.traced_peaks.append(0)
+        tracemalloc.reset_peak()
+
+    def popTracedPeak(self):
+        # Pico da etapa que terminou, também repassado à etapa externa
+        peak = max(self.traced_peaks.pop(), tracemalloc.get_traced_memory()[1])
+        if self.traced_peaks:
+            self.traced_peaks[-1] = max(self.traced_peaks[-1], peak)
+        return peak
+
+    def pushResidentPeak(self):
+        # Guarda o pico residente da etapa externa até agora e reinicia o VmHWM para a nova etapa
+        if self.rss_peaks:
+            self.rss_peaks[-1] = max(self.rss_peaks[-1], residentHighWaterMark())
+        self.rss_peaks.append(0)
+        resetResidentHighWaterMark()
+
+    def popResidentPeak(self):
+        # Pico residente da etapa que terminou (MB), também repassado à etapa externa
+        peak = max(self.rss_peaks.pop(), residentHighWaterMark())
+        if self.rss_peaks:
+            self.rss_peaks[-1] = max(self.rss_peaks[-1], peak)
+        return peak
+
+    def dumpProfile(self, profiler, record):
+        # Um arquivo por etapa: <sistema>_<réplica>_<etapa>[_<janela>]_<pid>.prof
+        parts = [str(record.get(key)) for key in ('system', 'replica', 'stage', 'window') if record.get(key) is not None]
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profile_path = os.path.join(self.profile_dir, '_'.join(parts + [str(os.getpid())]) + '.prof')
+        profiler.dump_stats(profile_path)
+        return profile_path
+
+    def emit(self, record):
+        record = dict(record, time=time.time(), host=socket.gethostname(), pid=os.getpid())
+        if self.log_path is None:
+            return
+        line = json.dumps(record, default=str) + '\n'
+        # Uma única escrita por linha em modo append, evitando linhas misturadas entre processos
+        fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+        finally:
+            os.close(fd)
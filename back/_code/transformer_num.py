@@ -7,137 +7,983 @@ import random
 import numpy as np
 import mdtraj as md
 import math
+import functools
+import collections
 import matplotlib.pyplot as plt
 import os
 import struct
+import argparse
+import time
+import multiprocessing
+import concurrent.futures
+
+from array_backend import BACKENDS, getBackend
+from build_cache import BuildCache
+from instrumentation import Instrumentation, PROFILE_MODES
+from ensemble import Ensemble
+from differential import Differential, defaultPairs
+from events import Events
+from dccm_container import DCCMFileWriter, NAME_BYTES, encodeNames, writeDCCMContainer
+from dccm_encoding import ENCODINGS, COMPRESSIONS, DELTA_KEYFRAME, TIPO_SPARSE_COO, SPARSE_EDGE_DTYPE, encodeSlices, compressionAvailable
+
+# Versão do algoritmo registrada no manifesto de cada arquivo gerado,
+# deve ser incrementada sempre que uma mudança no código alterar os valores calculados
+ALGORITHM_VERSION = 1
+
+# Tamanhos de janela padrão, em frames
+SLICE_SIZES = [25, 50, 100, 200, 400, 800, 1600]
+
+# Coordenadas alinhadas (e nomes dos resíduos) guardadas ao lado da réplica, ver cachedXTCandGRO
+ALIGNED_XYZ_NAME = 'aligned_CA.npy'
+ALIGNED_NAMES_NAME = 'aligned_CA_names.npy'
+
+# Modos de agregação das coordenadas antes da covariância (ver inputSelection)
+COARSE_GRAIN_MODES = ['atom', 'residue', 'domain']
+WEIGHTING_MODES = ['centroid', 'mass']
+
+# Variáveis de ambiente que limitam as threads das bibliotecas de BLAS usadas pelo numpy
+BLAS_THREAD_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS', 'NUMBA_NUM_THREADS']
+
+# Opções das saídas que reúnem todas as janelas da réplica e o valor que as desliga, com --split-windows
+# são escritas apenas pela tarefa da réplica
+REPLICA_OUTPUTS = {'container': False, 'pyramid': False, 'sliding': []}
 
 # Classe principal responsável pelo gerenciamento das outras classes 
 class dataTranformer:
-    def __init__(self):
-        self.algs = Algorithms(self)
+    def __init__(self, backend=None, metrics=None, profile=None):
+        self.algs = Algorithms(self, backend)
+        self.cache = BuildCache(self)
+        # Métricas por etapa em JSON-lines, desativadas quando 'metrics' e 'profile' são None
+        self.instrumentation = Instrumentation(self, metrics, profile)
+        self.ensemble = Ensemble(self)
+        self.differential = Differential(self)
+        self.events = Events(self)
 
 
 # Classe que contém os algoritmos desenvolvidos
 class Algorithms:
     
-    def __init__(self, parent):
+    def __init__(self, parent, backend=None):
         self.utils = parent
+        # Backend de arrays dos kernels (numpy por padrão, 'auto' usa a GPU quando disponível), ver array_backend.py
+        self.backend = getBackend(backend)
 
     # Principal função iterada nos dados
-    def processTrajectory(self, path):
+    def processTrajectory(self, path, slice_sizes=None, streaming=False, chunk_size=1000, force=False, container=False,
+                          encoding='float32', compression='none', sliding=None, pyramid=False, sparse_threshold=None, sparse_top_k=None,
+                          coordinate_cache=False, trajectory_file='traj_CA.xtc', topology_file='protein_CA_only.gro',
+                          selection=None, coarse_grain='atom', weighting='centroid', domains=None, max_lag=None, window_files=True):
         
+        trajectory_path = os.path.join(path, trajectory_file)
+        gro_path = os.path.join(path, topology_file)
+
+        # Seleção de átomos e agregação por resíduo/domínio, também registradas nos parâmetros de cada arquivo do manifesto
+        input_options = {'selection': selection, 'coarse_grain': coarse_grain, 'weighting': weighting, 'domains': domains}
+        self.input_settings = self.inputSettings(trajectory_file, topology_file, input_options)
+
+        # Todas as etapas registradas pela instrumentação levam o sistema e a réplica, as etapas repetidas em cada lote
+        # (DCCM e escrita de cada janela) são somadas em uma linha por janela
+        stage = self.utils.instrumentation.stage
+        accumulate = self.utils.instrumentation.accumulate
+        self.utils.instrumentation.setContext(system=os.path.basename(os.path.dirname(os.path.normpath(path))),
+                                              replica=os.path.basename(os.path.normpath(path)))
+
+        # Define diferentes tamanhos de janelas para calcular a correlação segmentada
+        if slice_sizes is None:
+            slice_sizes = SLICE_SIZES
+
+        # Codificação dos valores (tipo_dado_id) e compressão das fatias no container
+        tipo_dado_id = ENCODINGS[encoding]
+        compressao = COMPRESSIONS[compression]
+
+        # Consulta o manifesto da réplica, apenas janelas com entradas, parâmetros ou versão diferentes são recalculadas
+        cache = self.utils.cache
+        manifest = cache.loadManifest(path)
+        input_digests = cache.inputDigests(manifest, {trajectory_file: trajectory_path, topology_file: gro_path})
+        # Sem window_files apenas as saídas que reúnem todas as janelas da réplica são escritas (tarefa da réplica do --split-windows)
+        stale_dense = [slice_size for slice_size in slice_sizes if window_files and
+                       (force or not cache.isFresh(manifest, path, f'dccm_data_{slice_size}.bin', input_digests, self.outputSettings(slice_size, tipo_dado_id)))]
+
+        # Exportação esparsa (apenas as correlações acima do limiar e/ou as top-k de cada resíduo)
+        sparse = sparse_threshold is not None or sparse_top_k is not None
+        stale_sparse = [slice_size for slice_size in slice_sizes if window_files and sparse and
+                        (force or not cache.isFresh(manifest, path, f'dccm_sparse_{slice_size}.bin', input_digests, self.sparseSettings(slice_size, sparse_threshold, sparse_top_k)))]
+
+        # O container guarda todas as janelas juntas, se estiver desatualizado todas precisam ser calculadas
+        container_stale = container and (force or not cache.isFresh(manifest, path, 'dccm_data.dccm', input_digests, self.containerSettings(slice_sizes, tipo_dado_id, compressao)))
+        stale_sizes = sorted(set(slice_sizes) if container_stale else set(stale_dense) | set(stale_sparse))
+
+        # Pirâmide de resoluções a partir da menor janela, guardada em um único container (dccm_pyramid.dccm)
+        pyramid_base = min(slice_sizes)
+        pyramid_stale = pyramid and (force or not cache.isFresh(manifest, path, 'dccm_pyramid.dccm', input_digests, self.pyramidSettings(pyramid_base, tipo_dado_id, compressao)))
+
+        # Janelas deslizantes (sobrepostas), pares (janela, passo)
+        stale_sliding = [(window, stride) for window, stride in (sliding or [])
+                         if force or not cache.isFresh(manifest, path, f'dccm_data_{window}_stride_{stride}.bin', input_digests, self.slidingSettings(window, stride, tipo_dado_id))]
+
+        # DCCM com atraso (lag) de 0 a ±max_lag frames em cada janela, um arquivo por lag
+        stale_lagged = [slice_size for slice_size in slice_sizes if window_files and max_lag is not None and
+                        (force or not all(cache.isFresh(manifest, path, self.laggedFileName(slice_size, lag), input_digests, self.laggedSettings(slice_size, max_lag, tipo_dado_id))
+                                          for lag in range(-max_lag, max_lag + 1)))]
+
+        if not stale_sizes and not stale_sliding and not pyramid_stale and not stale_lagged:
+            print(f"Arquivos de '{path}' já estão atualizados")
+            cache.saveManifest(path, manifest)
+            return
+        all_slice_sizes, slice_sizes = slice_sizes, stale_sizes
+
         # Reconhece a trajetória e nomes dos resíduos utilizando a biblioteca MDtraj
-        trajectory_path = os.path.join(path, 'traj_CA.xtc')
-        gro_path = os.path.join(path, 'protein_CA_only.gro')
-        traj, names = self.matrixFromXTCandGRO(trajectory_path, gro_path)  
+        if coordinate_cache:
+            # Coordenadas já alinhadas mapeadas em memória a partir do aligned_CA.npy, o XTC só é lido quando estiver desatualizado
+            with stage('coordinate_cache'):
+                loadFrames = self.cachedXTCandGRO(path, trajectory_path, gro_path, manifest, input_digests, streaming, chunk_size, input_options)
+        elif streaming:
+            # Os frames são lidos em pedaços conforme o cálculo avança, a memória fica limitada a um chunk mais um bloco,
+            # cada passada pela trajetória abre uma nova leitura
+            loadFrames = lambda: self.streamXTCandGRO(trajectory_path, gro_path, chunk_size, input_options)
+        else:
+            loaded = self.matrixFromXTCandGRO(trajectory_path, gro_path, input_options)
+            loadFrames = lambda: loaded
+        traj, names = loadFrames()
 
         # Padroniza o tamanho das strings contendo os nomes dos resíduos (4 bytes)
-        encoded_names = b''.join([name.encode('utf-8').ljust(4, b'\0') for name in names])
+        encoded_names = encodeNames(names)
 
-        # Define diferentes tamanhos de janelas para calcular a correlação segmentada
-        slice_sizes = [25, 50, 100, 200, 400, 800, 1600]
+        for window, stride in stale_sliding:
+            # Cada lote de janelas deslizantes é escrito assim que é calculado, como nos arquivos dccm_data_*.bin,
+            # o arquivo só é criado quando a trajetória completa ao menos uma janela
+            output_name = f'dccm_data_{window}_stride_{stride}.bin'
+            writer = None
+            with stage('sliding', window=window, stride=stride, streaming=streaming) as record:
+                try:
+                    for dados_compactados in self.iterSlidingDCCM(loadFrames()[0], window, stride):
+                        with accumulate('write', window=window, stride=stride, output=output_name):
+                            if writer is None:
+                                writer = DCCMFileWriter(os.path.join(path, output_name), encoded_names, tipo_dado_id)
+                            writer.append(dados_compactados)
+                finally:
+                    if writer is not None:
+                        with accumulate('write', window=window, stride=stride, output=output_name):
+                            self.closeDCCMFile(writer)
+                record['slices'] = writer.num_fatias if writer is not None else 0
+            self.utils.instrumentation.flushAccumulated()
+            if writer is None:
+                print(f"Trajetória menor que a janela de {window} frames, arquivo não gerado")
+            cache.recordOutput(path, manifest, output_name, input_digests, self.slidingSettings(window, stride, tipo_dado_id))
+
+        for slice_size in stale_lagged:
+            output_names = {lag: self.laggedFileName(slice_size, lag) for lag in range(-max_lag, max_lag + 1)}
+            if slice_size <= max_lag:
+                print(f"Janela de {slice_size} frames não comporta o lag de {max_lag} frames, arquivos não gerados")
+            else:
+                with stage('lagged', window=slice_size, max_lag=max_lag, streaming=streaming) as record:
+                    record['slices'] = self.writeLaggedDCCMFiles({lag: os.path.join(path, name) for lag, name in output_names.items()},
+                                                                 loadFrames()[0], slice_size, max_lag, encoded_names, tipo_dado_id)
+            for lag, output_name in output_names.items():
+                cache.recordOutput(path, manifest, output_name, input_digests, self.laggedSettings(slice_size, max_lag, tipo_dado_id))
+
+        if not slice_sizes and not pyramid_stale:
+            return
+
+        # Cálcula todas as janelas em uma única passada pela trajetória, os momentos de cada bloco são somados na janela
+        # aberta de cada tamanho e cada lote de janelas completas é escrito assim que sai do iterWindowDCCM
+        # A memória fica limitada a um lote de blocos mais uma janela aberta por tamanho, apenas o container e a pirâmide
+        # mantêm as fatias em memória, pois são codificados e indexados juntos no final
+        block_size = functools.reduce(math.gcd, slice_sizes + ([pyramid_base] if pyramid_stale else []))
+        num_fatias = collections.Counter()
+        dense_files = {}
+        sparse_edges = {slice_size: [] for slice_size in stale_sparse}
+        DCCM_windows = collections.defaultdict(list)
+        # No modo streaming a leitura e o alinhamento de cada pedaço acontecem dentro desta etapa
+        with stage('windows', block_size=block_size, windows=slice_sizes, streaming=streaming) as record:
+            try:
+                for slice_size, dados_compactados in self.iterWindowDCCM(loadFrames()[0], block_size, slice_sizes, pyramid_base if pyramid_stale else None):
+                    num_fatias[slice_size] += len(dados_compactados)
+                    if slice_size in stale_dense:
+                        # A codificação (tipo_dado_id) das fatias compactadas acontece dentro da escrita
+                        with accumulate('write', window=slice_size, output=f'dccm_data_{slice_size}.bin'):
+                            if slice_size not in dense_files:
+                                dense_files[slice_size] = DCCMFileWriter(os.path.join(path, f'dccm_data_{slice_size}.bin'), encoded_names, tipo_dado_id)
+                            dense_files[slice_size].append(dados_compactados)
+                    if slice_size in stale_sparse:
+                        with accumulate('sparse', window=slice_size):
+                            sparse_edges[slice_size].extend(self.sparseEdges(fatia, len(names), sparse_threshold, sparse_top_k) for fatia in dados_compactados)
+                    if (container_stale and slice_size in all_slice_sizes) or (pyramid_stale and self.isPyramidLevel(slice_size, pyramid_base)):
+                        DCCM_windows[slice_size].append(dados_compactados)
+            finally:
+                for slice_size, writer in dense_files.items():
+                    with accumulate('write', window=slice_size, output=f'dccm_data_{slice_size}.bin'):
+                        self.closeDCCMFile(writer)
+            record['slices'] = sum(num_fatias.values())
+        self.utils.instrumentation.flushAccumulated()
+        DCCM_windows = {slice_size: np.concatenate(batches) for slice_size, batches in DCCM_windows.items()}
+
+        if pyramid_stale:
+            # Os níveis da pirâmide saem da mesma passada, cada nível é a fusão par a par das janelas do nível anterior
+            levels = {level_size: DCCM_windows[level_size] for level_size in DCCM_windows if self.isPyramidLevel(level_size, pyramid_base)}
+            output_filename = os.path.join(path, 'dccm_pyramid.dccm')
+            with stage('encode', output='dccm_pyramid.dccm', encoding=encoding, compression=compression):
+                windows = {level_size: encodeSlices(levels[level_size], tipo_dado_id, compressao, DELTA_KEYFRAME) for level_size in levels}
+            with stage('write', output='dccm_pyramid.dccm') as record:
+                size = writeDCCMContainer(output_filename, windows, len(names), encoded_names, tipo_dado_id, compressao, DELTA_KEYFRAME)
+                record['bytes'] = size
+            print(f"Pirâmide '{output_filename}' salva com sucesso! ({size / 1024:.2f} KB, níveis {sorted(levels)})")
+            cache.recordOutput(path, manifest, 'dccm_pyramid.dccm', input_digests, self.pyramidSettings(pyramid_base, tipo_dado_id, compressao))
 
         for slice_size in slice_sizes:
-        
-            # 'Fatia' a trajetória de acordo com o tamanho da janela, 
-            # recebe uma trajetória (coordenadas que mudam com o tempo) e devolve o número de fatias necessárias para contemplar o tamanho da janela
-            sliced_trajectory = self.slicedTrajectory(traj, slice_size)
+            if num_fatias[slice_size] == 0:
+                print(f"Trajetória menor que a janela de {slice_size} frames, arquivo não gerado")
 
-            # Cálcula o método para cada uma das janelas
-            DCCM_slices = self.calculateDCCMfromSlices(sliced_trajectory)
-        
-            DTYPE = np.float32
-        
-            num_fatias = len(DCCM_slices)
-            num_atomos = len(DCCM_slices[0])
-            
-            # Compacta os dados para que não seja necessária o armazenamento de dados redundantes
-            indices_triu = np.triu_indices(num_atomos)
-            num_elementos_triangulo = len(indices_triu[0])
-            dados_compactados = np.zeros((num_fatias, num_elementos_triangulo), dtype=DTYPE)
-            for i in range(num_fatias):
-                dados_compactados[i] = DCCM_slices[i][indices_triu]
-
-            output_filename = os.path.join(path, f'dccm_data_{slice_size}.bin')
-            with open(output_filename, 'wb') as f:
-                tipo_dado_id = 1 
-                # Empacota os metadados em formato binário. (Header)
-                header = struct.pack('<III', num_fatias, num_atomos, tipo_dado_id)
-                f.write(header)
-            
-                # Escrever o Corpo (Payload) - Primeiramente os nomes dos resíduos
-                f.write(encoded_names)
-                # Segundamente escreve o array numpy diretamente para o arquivo.
-                f.write(dados_compactados.tobytes())
-            
-
-            # Prints que demonstram a evolução das trajetórias sendo analisadas
-            print(f"Arquivo '{output_filename}' salvo com sucesso!")
-            print(f"Dimensões originais por fatia: {num_atomos}x{num_atomos} = {num_atomos*num_atomos} floats")
-            print(f"Dimensões compactadas por fatia: {num_elementos_triangulo} floats")
-            tamanho_original_total = num_fatias * num_atomos * num_atomos * 4 # 4 bytes por float32
-            tamanho_compactado_total = len(header) + num_fatias * num_elementos_triangulo * 4
-            print(f"Tamanho original estimado: {tamanho_original_total / 1024:.2f} KB")
-            print(f"Tamanho final do arquivo: {tamanho_compactado_total / 1024:.2f} KB")
+            if slice_size in stale_dense:
+                cache.recordOutput(path, manifest, f'dccm_data_{slice_size}.bin', input_digests, self.outputSettings(slice_size, tipo_dado_id))
+
+            if slice_size in stale_sparse:
+                output_name = f'dccm_sparse_{slice_size}.bin'
+                if num_fatias[slice_size] > 0:
+                    with stage('write', window=slice_size, output=output_name, slices=num_fatias[slice_size]):
+                        self.writeSparseEdges(os.path.join(path, output_name), sparse_edges[slice_size], len(names), encoded_names)
+                cache.recordOutput(path, manifest, output_name, input_digests, self.sparseSettings(slice_size, sparse_threshold, sparse_top_k))
+
+        if container_stale:
+            # Todas as janelas em um único arquivo com índice de fatias, permitindo acesso aleatório
+            output_filename = os.path.join(path, 'dccm_data.dccm')
+            with stage('encode', output='dccm_data.dccm', encoding=encoding, compression=compression):
+                windows = {slice_size: encodeSlices(DCCM_windows[slice_size], tipo_dado_id, compressao, DELTA_KEYFRAME)
+                           for slice_size in all_slice_sizes if slice_size in DCCM_windows}
+            with stage('write', output='dccm_data.dccm') as record:
+                size = writeDCCMContainer(output_filename, windows, len(names), encoded_names, tipo_dado_id, compressao, DELTA_KEYFRAME)
+                record['bytes'] = size
+
+            print(f"Container '{output_filename}' salvo com sucesso! ({size / 1024:.2f} KB, janelas {sorted(windows)})")
+            if windows:
+                # Sem janelas (todas maiores que a trajetória) o container tem apenas o header e não há razão a informar
+                tamanho_float32 = sum(len(DCCM_windows[slice_size]) for slice_size in windows) * DCCM_windows[min(windows)].shape[1] * 4
+                print(f"Codificação {encoding}/{compression}: razão de compressão {tamanho_float32 / size:.2f}x em relação ao float32")
+            cache.recordOutput(path, manifest, 'dccm_data.dccm', input_digests, self.containerSettings(all_slice_sizes, tipo_dado_id, compressao))
         return
+
+    def outputSettings(self, slice_size, tipo_dado_id=1):
+        # Parâmetros que definem o conteúdo de um arquivo de saída, registrados no manifesto
+        settings = {
+            'slice_size': slice_size,
+            'alignment': 'superpose_frame_0',
+            # Os momentos dos blocos sempre descartam os frames finais (ver slicedTrajectory)
+            'remainder': 'drop',
+            'tipo_dado_id': tipo_dado_id,
+            'version': ALGORITHM_VERSION,
+        }
+        if getattr(self, 'input_settings', None):
+            settings['input'] = self.input_settings
+        return settings
+
+    def inputSettings(self, trajectory_file, topology_file, input_options):
+        # Apenas entradas diferentes do padrão (C-alpha já extraídos, sem agregação) são registradas,
+        # mantendo válidos os manifestos gerados antes destas opções
+        settings = {}
+        if (trajectory_file, topology_file) != ('traj_CA.xtc', 'protein_CA_only.gro'):
+            settings['files'] = [trajectory_file, topology_file]
+        if input_options.get('selection') is not None:
+            settings['selection'] = input_options['selection']
+        if input_options.get('coarse_grain', 'atom') != 'atom':
+            settings['coarse_grain'] = input_options['coarse_grain']
+            settings['weighting'] = input_options.get('weighting', 'centroid')
+            if input_options['coarse_grain'] == 'domain':
+                settings['domains'] = list(input_options.get('domains') or [])
+        return settings
+
+    def slidingSettings(self, window, stride, tipo_dado_id=1):
+        # Parâmetros das janelas deslizantes, o passo entre o início de janelas consecutivas também define o arquivo
+        settings = self.outputSettings(window, tipo_dado_id)
+        settings['stride'] = stride
+        return settings
+
+    def laggedFileName(self, slice_size, lag):
+        # Ex: dccm_lag_100_t-5.bin, dccm_lag_100_t0.bin, dccm_lag_100_t5.bin
+        return f'dccm_lag_{slice_size}_t{lag}.bin'
+
+    def laggedSettings(self, slice_size, max_lag, tipo_dado_id=1):
+        # Parâmetros da DCCM com atraso, todos os lags de uma janela são calculados juntos
+        settings = self.outputSettings(slice_size, tipo_dado_id)
+        settings['max_lag'] = max_lag
+        settings['lag_normalization'] = 'overlap'
+        return settings
+
+    def sparseSettings(self, slice_size, threshold, top_k):
+        # Parâmetros da exportação esparsa, o critério de seleção das arestas também define o arquivo
+        settings = self.outputSettings(slice_size, TIPO_SPARSE_COO)
+        settings['threshold'] = threshold
+        settings['top_k'] = top_k
+        return settings
+
+    def pyramidSettings(self, base_size, tipo_dado_id=1, compressao=0):
+        # Parâmetros da pirâmide, os níveis são definidos pela janela base e pelo tamanho da trajetória
+        settings = self.outputSettings(base_size, tipo_dado_id)
+        settings['pyramid'] = True
+        settings['compressao'] = compressao
+        return settings
+
+    def alignedSettings(self):
+        # Parâmetros das coordenadas alinhadas guardadas em cache
+        settings = {
+            'alignment': 'superpose_frame_0',
+            'dtype': 'float32',
+            'version': ALGORITHM_VERSION,
+        }
+        if getattr(self, 'input_settings', None):
+            settings['input'] = self.input_settings
+        return settings
+
+    def containerSettings(self, slice_sizes, tipo_dado_id=1, compressao=0):
+        # Parâmetros do container, o mesmo de cada arquivo .bin mas com todas as janelas
+        settings = self.outputSettings(None, tipo_dado_id)
+        settings['slice_size'] = sorted(slice_sizes)
+        settings['compressao'] = compressao
+        return settings
+
+    def writeDCCMFile(self, output_filename, dados_compactados, num_atomos, encoded_names, tipo_dado_id=1):
+
+        # Os dados chegam compactados, (num_fatias, num_elementos_triangulo) na ordem do np.triu_indices,
+        # e são convertidos para a codificação do tipo_dado_id (1 float32, 2 float16, 3 int8)
+        writer = DCCMFileWriter(output_filename, encoded_names, tipo_dado_id)
+        try:
+            writer.append(dados_compactados)
+        finally:
+            self.closeDCCMFile(writer)
+
+    def closeDCCMFile(self, writer):
+        # Fecha um arquivo escrito em lotes (DCCMFileWriter), corrigindo o header
+        size = writer.close()
+        num_atomos = writer.num_atomos
+        num_elementos_triangulo = num_atomos * (num_atomos + 1) // 2
+
+        # Prints que demonstram a evolução das trajetórias sendo analisadas
+        print(f"Arquivo '{writer.output_filename}' salvo com sucesso!")
+        print(f"Dimensões originais por fatia: {num_atomos}x{num_atomos} = {num_atomos*num_atomos} floats")
+        print(f"Dimensões compactadas por fatia: {num_elementos_triangulo} floats")
+        tamanho_original_total = writer.num_fatias * num_atomos * num_atomos * 4 # 4 bytes por float32
+        print(f"Tamanho original estimado: {tamanho_original_total / 1024:.2f} KB")
+        print(f"Tamanho final do arquivo: {size / 1024:.2f} KB")
+        if writer.tipo_dado_id != 1:
+            print(f"Erro máximo da codificação (tipo {writer.tipo_dado_id}): {writer.erro_maximo:.2e}")
     
-    def matrixFromXTCandGRO(self, ca_path, gro_path):
+    def sparseEdges(self, fatia, n_atoms, threshold=None, top_k=None):
+        # Seleciona as arestas (i < j) de uma fatia compactada: |correlação| >= threshold e/ou entre as top_k de cada resíduo
+        # A diagonal (sempre 1) nunca é exportada
+        rows, cols = np.triu_indices(n_atoms, k=1)
+        values = fatia[self.packedRowOffset(rows, n_atoms) + (cols - rows)]
+        keep = np.ones(len(values), dtype=bool)
+
+        if threshold is not None:
+            keep &= np.abs(values) >= threshold
+
+        if top_k is not None and top_k < n_atoms - 1:
+            # Uma aresta fica se estiver entre as top_k de qualquer um dos dois resíduos
+            magnitude = np.full((n_atoms, n_atoms), -1.0, dtype=np.float32)
+            magnitude[rows, cols] = np.abs(values)
+            magnitude[cols, rows] = magnitude[rows, cols]
+            top = np.argpartition(magnitude, -top_k, axis=1)[:, -top_k:]
+            selected = np.zeros((n_atoms, n_atoms), dtype=bool)
+            selected[np.arange(n_atoms)[:, None], top] = True
+            keep &= (selected | selected.T)[rows, cols]
+
+        edges = np.empty(np.count_nonzero(keep), dtype=SPARSE_EDGE_DTYPE)
+        edges['i'] = rows[keep]
+        edges['j'] = cols[keep]
+        edges['value'] = values[keep]
+        return edges
+
+    def writeSparseEdges(self, output_filename, edges, num_atomos, encoded_names):
+        # Lista de arestas (COO) por fatia, tipo_dado_id 4:
+        # header '<III', nomes dos resíduos, (num_fatias + 1) posições '<u8' do início das arestas de cada fatia,
+        # e as arestas (i '<u2', j '<u2', valor '<f4') de todas as fatias em sequência
+        if num_atomos > np.iinfo(np.uint16).max:
+            raise ValueError(f"Exportação esparsa suporta até {np.iinfo(np.uint16).max} resíduos")
+
+        num_fatias = len(edges)
+        offsets = np.zeros(num_fatias + 1, dtype='<u8')
+        offsets[1:] = np.cumsum([len(fatia_edges) for fatia_edges in edges])
+
+        with open(output_filename, 'wb') as f:
+            header = struct.pack('<III', num_fatias, num_atomos, TIPO_SPARSE_COO)
+            f.write(header)
+            f.write(encoded_names)
+            f.write(offsets.tobytes())
+            for fatia_edges in edges:
+                f.write(fatia_edges.tobytes())
+
+        # Tamanho e fração das correlações mantidas em relação ao arquivo denso
+        total_pares = num_fatias * num_atomos * (num_atomos - 1) // 2
+        tamanho_esparso = len(header) + len(encoded_names) + offsets.nbytes + int(offsets[-1]) * SPARSE_EDGE_DTYPE.itemsize
+        tamanho_denso = len(header) + len(encoded_names) + num_fatias * num_atomos * (num_atomos + 1) // 2 * 4
+        print(f"Arquivo '{output_filename}' salvo com sucesso!")
+        print(f"Arestas mantidas: {int(offsets[-1])} de {total_pares} ({100 * int(offsets[-1]) / max(total_pares, 1):.2f}%)")
+        print(f"Tamanho do arquivo esparso: {tamanho_esparso / 1024:.2f} KB (denso: {tamanho_denso / 1024:.2f} KB)")
+
+    def writeLaggedDCCMFiles(self, output_filenames, traj, slice_size, max_lag, encoded_names, tipo_dado_id=1):
+        # Um arquivo .bin por lag {lag: caminho}, no mesmo formato dos dccm_data_*.bin (fatia i -> janela i), assim cada lag
+        # abre nos mesmos leitores e visualizadores. As fatias são escritas em lotes conforme são calculadas, e os arquivos
+        # só são criados quando a trajetória completa ao menos uma janela
+        writers = {}
+        try:
+            for sliced_traj in self.iterSlices(traj, slice_size):
+                lagged = self.calculateLaggedDCCM(sliced_traj, max_lag)
+                for lag, output_filename in output_filenames.items():
+                    if lag not in writers:
+                        writers[lag] = DCCMFileWriter(output_filename, encoded_names, tipo_dado_id)
+                    writers[lag].append(lagged[lag + max_lag])
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        num_fatias = writers[0].num_fatias if writers else 0
+        if num_fatias == 0:
+            print(f"Trajetória menor que a janela de {slice_size} frames, arquivos com atraso não gerados")
+        else:
+            print(f"DCCM com atraso da janela {slice_size} salva com sucesso! (lags -{max_lag} a {max_lag}, {num_fatias} fatias, {len(writers)} arquivos)")
+        return num_fatias
+
+    def streamXTCandGRO(self, ca_path, gro_path, chunk_size=1000, input_options=None):
+        # Versão em streaming do matrixFromXTCandGRO, a trajetória é lida em pedaços de 'chunk_size' frames
+        # e nunca fica inteira em memória
+        atom_indices, weights, names = self.inputSelection(gro_path, **(input_options or {}))
+        reference = md.load_frame(ca_path, 0, top=gro_path, atom_indices=atom_indices)
+
+        def alignedChunks():
+            for chunk in md.iterload(ca_path, top=gro_path, chunk=chunk_size, atom_indices=atom_indices):
+                # Cada pedaço é alinhado ao frame 0 da trajetória, o mesmo resultado do alinhamento em memória
+                chunk.superpose(reference, 0)
+                yield self.coarseGrain(chunk.xyz, weights)
+
+        return alignedChunks(), names
+
+    def inputSelection(self, gro_path, selection=None, coarse_grain='atom', weighting='centroid', domains=None):
+        # Define quais átomos são lidos (expressão de seleção do mdtraj, ex: 'name CA' ou 'protein and backbone')
+        # e como são agregados antes da covariância:
+        #   'atom'    -> cada átomo selecionado é um ponto (comportamento original)
+        #   'residue' -> um ponto por resíduo
+        #   'domain'  -> um ponto por domínio, 'domains' no formato NOME:INICIO-FIM (números dos resíduos no GRO)
+        # Os pontos são o centroide ('centroid') ou o centro de massa ('mass') dos átomos do grupo.
+        # Devolve (índices dos átomos ou None, matriz de pesos (grupos, átomos) ou None, nomes de cada ponto)
+        if coarse_grain not in COARSE_GRAIN_MODES:
+            raise ValueError(f"Modo de agregação desconhecido: {coarse_grain}")
+        if weighting not in WEIGHTING_MODES:
+            raise ValueError(f"Modo de peso desconhecido: {weighting}")
+
+        topology = md.load_topology(gro_path)
+        atom_indices = None
+        if selection is not None:
+            atom_indices = topology.select(selection)
+            if len(atom_indices) == 0:
+                raise ValueError(f"A seleção '{selection}' não contém átomos de '{gro_path}'")
+            topology = topology.subset(atom_indices)
+        atoms = list(topology.atoms)
+
+        if coarse_grain == 'atom':
+            return atom_indices, None, [atom.residue.name for atom in atoms]
+
+        # Grupos de átomos (posições dentro da seleção) e o nome de cada grupo
+        groups = collections.OrderedDict()
+        if coarse_grain == 'residue':
+            for position, atom in enumerate(atoms):
+                groups.setdefault((atom.residue.index, atom.residue.name), []).append(position)
+            names = [name for _, name in groups]
+        else:
+            if not domains:
+                raise ValueError("A agregação por domínio necessita de domínios no formato NOME:INICIO-FIM")
+            for domain in domains:
+                label, first, last = parseDomain(domain)
+                members = [position for position, atom in enumerate(atoms) if first <= atom.residue.resSeq <= last]
+                if not members:
+                    raise ValueError(f"O domínio '{domain}' não contém átomos selecionados")
+                groups[label] = members
+            names = list(groups)
+
+        # Cada linha da matriz soma 1, coarse = pesos @ coordenadas
+        weights = np.zeros((len(groups), len(atoms)), dtype=np.float32)
+        for g, members in enumerate(groups.values()):
+            if weighting == 'mass':
+                masses = np.array([atoms[m].element.mass if atoms[m].element is not None else 0.0 for m in members], dtype=np.float64)
+            else:
+                masses = np.ones(len(members))
+            if masses.sum() <= 0:
+                # Elementos desconhecidos (ex: sítios virtuais), usa o centroide
+                masses = np.ones(len(members))
+            weights[g, members] = masses / masses.sum()
+        return atom_indices, weights, names
+
+    def coarseGrain(self, xyz, weights):
+        # (frames, átomos, 3) -> (frames, grupos, 3), o custo da DCCM cai com o quadrado do número de pontos
+        if weights is None:
+            return xyz
+        return np.matmul(weights, xyz)
+
+    def cachedXTCandGRO(self, path, ca_path, gro_path, manifest, input_digests, streaming=False, chunk_size=1000, input_options=None):
+        # Guarda as coordenadas alinhadas (frames, átomos, 3) em aligned_CA.npy e os nomes em aligned_CA_names.npy,
+        # válidos enquanto o hash do XTC e do GRO registrado no manifesto for o mesmo.
+        # Devolve uma função no formato do loadFrames do processTrajectory, lendo do arquivo mapeado em memória
+        cache = self.utils.cache
+        xyz_path = os.path.join(path, ALIGNED_XYZ_NAME)
+        names_path = os.path.join(path, ALIGNED_NAMES_NAME)
+
+        if not (os.path.exists(names_path) and cache.isFresh(manifest, path, ALIGNED_XYZ_NAME, input_digests, self.alignedSettings())):
+            # Arquivos temporários por processo, outras janelas da mesma réplica podem estar sendo calculadas em paralelo (--split-windows)
+            temp_path = f'{xyz_path}.{os.getpid()}.tmp'
+            temp_names_path = f'{names_path}.{os.getpid()}.tmp'
+            if streaming:
+                chunks, names = self.streamXTCandGRO(ca_path, gro_path, chunk_size, input_options)
+                self.saveAlignedChunks(temp_path, chunks, len(names))
+            else:
+                xyz, names = self.matrixFromXTCandGRO(ca_path, gro_path, input_options)
+                with open(temp_path, 'wb') as f:
+                    np.save(f, xyz.astype(np.float32, copy=False))
+            with open(temp_names_path, 'wb') as f:
+                np.save(f, np.array(names))
+            os.replace(temp_names_path, names_path)
+            os.replace(temp_path, xyz_path)
+            cache.recordOutput(path, manifest, ALIGNED_XYZ_NAME, input_digests, self.alignedSettings())
+            print(f"Coordenadas alinhadas salvas em '{xyz_path}'")
+
+        xyz = np.load(xyz_path, mmap_mode='r')
+        names = np.load(names_path).tolist()
+        if streaming:
+            return lambda: ((xyz[i:i + chunk_size] for i in range(0, len(xyz), chunk_size)), names)
+        return lambda: (xyz, names)
+
+    def saveAlignedChunks(self, output_filename, chunks, n_atoms):
+        # Escreve um .npy a partir dos pedaços do modo streaming, o número de frames só é conhecido no final,
+        # então os pedaços são escritos em um arquivo temporário e copiados após o header
+        raw_path = output_filename + '.raw'
+        n_frames = 0
+        with open(raw_path, 'wb') as raw:
+            for chunk in chunks:
+                raw.write(np.ascontiguousarray(chunk, dtype=np.float32).tobytes())
+                n_frames += len(chunk)
+
+        header = {'descr': np.lib.format.dtype_to_descr(np.dtype(np.float32)), 'fortran_order': False, 'shape': (n_frames, n_atoms, 3)}
+        with open(output_filename, 'wb') as f, open(raw_path, 'rb') as raw:
+            np.lib.format.write_array_header_1_0(f, header)
+            for block in iter(lambda: raw.read(1 << 24), b''):
+                f.write(block)
+        os.remove(raw_path)
+
+    def matrixFromXTCandGRO(self, ca_path, gro_path, input_options=None):
         # Utiliza o mdtraj para extrair trajetória em formato de coordenadas e também os nomes dos resíduos que cada C-alpha pertence
-        # TODO: Fazer funcionar para diferentes entradas
-        trajetory = md.load(ca_path, top=gro_path)
+        # Trajetórias com todos os átomos são aceitas com uma seleção e/ou agregação por resíduo ou domínio (ver inputSelection)
+        atom_indices, weights, names = self.inputSelection(gro_path, **(input_options or {}))
+        with self.utils.instrumentation.stage('read') as record:
+            trajetory = md.load(ca_path, top=gro_path, atom_indices=atom_indices)
+            record['frames'], record['atoms'] = trajetory.n_frames, trajetory.n_atoms
 
         # Alinha a trajetória com o frame 0, buscando eliminar a correlação totalmente positiva que a translação e rotação da molécular pode gerar
-        trajetory.superpose(trajetory, 0)
-        
-        # Coleta os nomes dos reíduos
-        names = [atom.residue.name for atom in trajetory.topology.atoms]
+        with self.utils.instrumentation.stage('superpose'):
+            trajetory.superpose(trajetory, 0)
+
+        # Agrega os átomos por resíduo ou domínio, quando pedido
+        with self.utils.instrumentation.stage('coarse_grain', points=len(names)):
+            xyz = self.coarseGrain(trajetory.xyz, weights)
         
         # Retorna as coordenadas que se alteram com o tempo e os nomes dos resíduos
-        return trajetory.xyz, names
+        return xyz, names
 
-    def slicedTrajectory(self, traj, slice_size):
-
-        # Tratar fatias remanescentes
-        n_slices = math.floor(len(traj) / slice_size)
-        aux_rest = len(traj) % slice_size
+    def slicedTrajectory(self, traj, slice_size, remainder='drop'):
+        # Devolve as fatias como uma visão (n_slices, slice_size, n_atoms, 3) da própria trajetória, sem cópias
+        # Política para os frames remanescentes (quando o tamanho da trajetória não é múltiplo da janela), válida apenas
+        # para o fatiamento direto (calculateDCCMfromSlices, calculateDCCMpacked), o processTrajectory monta as janelas
+        # pelos momentos dos blocos e sempre usa 'drop':
+        #   'drop'    -> descarta os frames finais que não completam uma janela (comportamento original)
+        #   'head'    -> descarta os frames iniciais, alinhando as janelas ao final da trajetória
+        #   'overlap' -> adiciona uma última janela com os últimos slice_size frames, sobreposta à anterior (exige uma cópia)
+        traj = np.ascontiguousarray(traj)
+        n_frames, n_atoms, _ = traj.shape
+        n_slices = n_frames // slice_size
+        aux_rest = n_frames % slice_size
 
-        # Trajetória segmentada
-        trajectory_sliced = None
+        if remainder not in ('drop', 'head', 'overlap'):
+            raise ValueError(f"Política de remanescentes desconhecida: {remainder}")
 
-        for i in range(0, n_slices, 1):
+        start = aux_rest if remainder == 'head' else 0
+        trajectory_sliced = traj[start:start + n_slices * slice_size].reshape(n_slices, slice_size, n_atoms, 3)
 
-            if i == n_slices - 1:
-                # TODO Tratamento mais ideal para as fatias remanescentes
-                if aux_rest > 0:
-                    # Trata a última fatia
-                    trajectory_sliced = np.concatenate([trajectory_sliced, [traj[(i*slice_size):(i*slice_size)+slice_size]]]) 
-                else:
-                    # Concatena última fatia
-                    trajectory_sliced = np.concatenate([trajectory_sliced, [traj[(i*slice_size):((i*slice_size)+slice_size)]]])
-            else:
-                if i == 0:
-                    # Concatena a primeira fatia
-                    trajectory_sliced = [traj[(i*slice_size):((i*slice_size)+slice_size)]]
-                else:
-                    # Concatena todas as outras fatias
-                    trajectory_sliced = np.concatenate([trajectory_sliced, [traj[(i*slice_size):((i*slice_size)+slice_size)]]])
+        if remainder == 'overlap' and aux_rest > 0 and n_slices > 0:
+            # As janelas partem do início e a última cobre os frames finais
+            trajectory_sliced = np.concatenate([trajectory_sliced, traj[None, n_frames - slice_size:]])
 
         return trajectory_sliced
 
-    def calculateDCCMfromSlices(self, sliced_traj):
-        # Cálcula o método para a primeira fatia
-        dccms = [self.calculateDCCM(sliced_traj[0])]
-        
-        # Cálcular o método para as fatias restantes
-        for i in range(1, len(sliced_traj), 1):
-            dccms = np.concatenate([dccms, [self.calculateDCCM(sliced_traj[i])]])
-        return dccms
+    def iterSlices(self, traj, slice_size, batch_slices=64):
+        # Gera lotes de até 'batch_slices' fatias (n, slice_size, n_atoms, 3) consecutivas, descartando os frames finais como no 'drop'
+        # 'traj' pode ser a trajetória em memória ou um iterável de pedaços (chunks) de frames, como no modo streaming
+        if isinstance(traj, np.ndarray):
+            sliced_traj = self.slicedTrajectory(traj, slice_size)
+            for start in range(0, len(sliced_traj), batch_slices):
+                yield sliced_traj[start:start + batch_slices]
+            return
+
+        pending = None
+        for chunk in traj:
+            if pending is not None and len(pending) > 0:
+                chunk = np.concatenate([pending, chunk])
+            n_slices = len(chunk) // slice_size
+            for start in range(0, n_slices, batch_slices):
+                stop = min(start + batch_slices, n_slices)
+                yield chunk[start*slice_size:stop*slice_size].reshape(stop - start, slice_size, *chunk.shape[1:])
+            pending = chunk[n_slices*slice_size:]
+
+    def calculateDCCMfromSlices(self, sliced_traj, out=None, batch_size=64):
+        n_slices, _, n_atoms, _ = sliced_traj.shape
+
+        # Buffer de saída pré-alocado, evita copiar a pilha acumulada a cada fatia
+        if out is None:
+            out = np.empty((n_slices, n_atoms, n_atoms), dtype=np.float32)
+
+        # Cálcula o método em lotes de fatias, limitando as flutuações temporárias a um lote
+        for start in range(0, n_slices, batch_size):
+            stop = min(start + batch_size, n_slices)
+            self.calculateDCCMbatched(sliced_traj[start:stop], out=out[start:stop])
+        return out
+
+    def calculateDCCMbatched(self, sliced_traj, out=None):
+        # Mesmo cálculo do calculateDCCM, porém para todas as fatias (n_slices, n_frames, n_atoms, 3) em um único matmul
+        if self.backend.fused:
+            return self.backend.fusedDCCM(sliced_traj, out)
+        n_slices, n_frames, n_atoms, _ = sliced_traj.shape
+        xp = self.backend.xp
+
+        coords = self.backend.asarray(sliced_traj, dtype=xp.float32)
+
+        # Flutuações em relação à posição média de cada fatia
+        fluctuations = coords - xp.mean(coords, axis=1, keepdims=True)
+
+        # (n_slices, n_frames, n_atoms, 3) -> (n_slices, n_atoms, n_frames * 3)
+        # Assim C_ik = Σ_tj f[t,i,j] * f[t,k,j] vira um produto de matrizes por fatia (GEMM em lote, via BLAS)
+        fluctuations = fluctuations.transpose(0, 2, 1, 3).reshape(n_slices, n_atoms, n_frames * 3)
+
+        # Na CPU o resultado é escrito direto no buffer de saída, em outros backends é copiado no final
+        if out is None and self.backend.on_host:
+            out = np.empty((n_slices, n_atoms, n_atoms), dtype=np.float32)
+        dccm = xp.matmul(fluctuations, fluctuations.transpose(0, 2, 1), out=out if self.backend.on_host else None)
+        dccm /= n_frames
+
+        # Normalização no próprio buffer, sem alocar a matriz de normalização (np.outer)
+        diag_sqrt = xp.sqrt(xp.diagonal(dccm, axis1=1, axis2=2) + 1e-10)
+        dccm /= diag_sqrt[:, :, None]
+        dccm /= diag_sqrt[:, None, :]
+        return self.backend.toHost(dccm, out)
+
+    def calculateDCCMpacked(self, sliced_traj, out=None, batch_size=64):
+        # Mesmo resultado do calculateDCCMfromSlices, porém já no layout compactado (n_slices, num_elementos_triangulo)
+        # Apenas o triângulo superior é calculado e cada fatia é escrita direto na sua posição do buffer
+        if self.backend.fused:
+            return self.backend.fusedDCCMpacked(sliced_traj, out)
+        n_slices, n_frames, n_atoms, _ = sliced_traj.shape
+
+        if out is None:
+            out = np.empty((n_slices, n_atoms * (n_atoms + 1) // 2), dtype=np.float32)
+
+        for start in range(0, n_slices, batch_size):
+            stop = min(start + batch_size, n_slices)
+            coords = self.backend.asarray(sliced_traj[start:stop], dtype=self.backend.xp.float32)
+            fluctuations = coords - self.backend.xp.mean(coords, axis=1, keepdims=True)
+            fluctuations = fluctuations.transpose(0, 2, 1, 3).reshape(stop - start, n_atoms, n_frames * 3)
+
+            self.packedGram(fluctuations, out[start:stop])
+            out[start:stop] /= n_frames
+            self.normalizePacked(out[start:stop], n_atoms)
+        return out
+
+    def packedRowOffset(self, i, n_atoms):
+        # Posição da linha i (elemento [i, i]) dentro do triângulo superior compactado
+        return i * n_atoms - (i * (i - 1)) // 2
+
+    def packedGram(self, vectors, out, block_rows=256):
+        # Calcula apenas o triângulo superior de vectors @ vectors^T, (n, n_atoms, k) -> (n, num_elementos_triangulo)
+        # Cada bloco de linhas multiplica somente as colunas j >= i, e as linhas são copiadas direto para o layout compactado
+        # O produto é feito no backend, 'out' (layout compactado) fica sempre na CPU
+        if self.backend.fused:
+            # Kernel compilado que escreve direto no layout compactado (numba)
+            return self.backend.packedGram(vectors, out)
+        n_batch, n_atoms, _ = vectors.shape
+        vectors = self.backend.asarray(vectors)
+        for r0 in range(0, n_atoms, block_rows):
+            r1 = min(r0 + block_rows, n_atoms)
+            block = self.backend.toHost(self.backend.xp.matmul(vectors[:, r0:r1], vectors[:, r0:].transpose(0, 2, 1)))
+            for i in range(r0, r1):
+                offset = self.packedRowOffset(i, n_atoms)
+                out[:, offset:offset + n_atoms - i] = block[:, i - r0, i - r0:]
+        return out
+
+    def normalizePacked(self, packed, n_atoms):
+        # Normaliza covariâncias compactadas pelas variâncias (diagonal), no próprio buffer
+        diag_offsets = np.array([self.packedRowOffset(i, n_atoms) for i in range(n_atoms)])
+        diag_sqrt = np.sqrt(packed[:, diag_offsets] + 1e-10)
+        for i in range(n_atoms):
+            offset = diag_offsets[i]
+            packed[:, offset:offset + n_atoms - i] /= diag_sqrt[:, i, None] * diag_sqrt[:, i:]
+        return packed
+
+    def calculateMultiWindowDCCM(self, traj, slice_sizes):
+        # Todas as janelas devem ser múltiplas de um bloco base (para [25, 50, ..., 1600] o bloco é 25)
+        block_size = functools.reduce(math.gcd, slice_sizes)
+
+        # Única passada pelos frames, as janelas maiores que a trajetória ficam vazias
+        n_atoms = traj.shape[1]
+        batches = collections.defaultdict(list)
+        for slice_size, dados_compactados in self.iterWindowDCCM(traj, block_size, slice_sizes):
+            batches[slice_size].append(dados_compactados)
+        return {slice_size: np.concatenate(batches[slice_size]) if batches[slice_size] else np.zeros((0, n_atoms * (n_atoms + 1) // 2), dtype=np.float32)
+                for slice_size in slice_sizes}
+
+    def isPyramidLevel(self, slice_size, base_size):
+        # Níveis da pirâmide: base_size vezes uma potência de 2
+        factor = slice_size // base_size
+        return slice_size % base_size == 0 and factor > 0 and factor & (factor - 1) == 0
+
+    def mergeMomentPairs(self, moments, pending=None):
+        # Soma pares consecutivos de janelas (counts, sums, cross), O(N²) por fusão. 'pending' é a janela ímpar do lote
+        # anterior, que forma par com a primeira deste, e a janela que sobrar fica pendente para o próximo lote
+        if pending is not None:
+            moments = tuple(np.concatenate([np.asarray(half)[None], part]) for half, part in zip(pending, moments))
+        stop = len(moments[0]) // 2 * 2
+        merged = tuple(part[0:stop:2] + part[1:stop:2] for part in moments)
+        pending = tuple(part[stop] for part in moments) if stop < len(moments[0]) else None
+        return merged, pending
+
+    def iterWindowDCCM(self, traj, block_size, slice_sizes, pyramid_base=None, batch_blocks=64):
+        # Gera (janela, fatias compactadas) conforme as janelas de cada tamanho são completadas, em uma única passada
+        # Cada tamanho guarda apenas os momentos da sua janela aberta, os blocos de cada lote são somados nela e as janelas
+        # completas do lote saem em seguida (C_ik = <r_i·r_k> - <r_i>·<r_k>, ver dccmFromMoments), a memória não cresce
+        # com o tamanho da trajetória. Com pyramid_base, os níveis acima da base (2*pyramid_base, 4*pyramid_base, ...)
+        # não somam blocos: cada janela de um nível é a fusão par a par de duas janelas já completas do nível anterior
+        merged_levels = {slice_size for slice_size in slice_sizes if pyramid_base and slice_size > pyramid_base and self.isPyramidLevel(slice_size, pyramid_base)}
+        open_windows = {slice_size: None for slice_size in (set(slice_sizes) - merged_levels) | ({pyramid_base} if pyramid_base else set())}
+        # Janela ímpar de cada nível da pirâmide, aguardando o seu par
+        halves = {}
+        for counts, sums, cross in self.iterBlockMoments(traj, block_size, batch_blocks):
+            n_blocks = len(counts)
+            for slice_size in sorted(open_windows):
+                blocks_per_window = slice_size // block_size
+                position = 0
+                window = open_windows[slice_size]
+                # Momentos das janelas completadas neste lote, (counts, sums, cross) de cada pedaço
+                completed = []
+
+                # Completa a janela aberta com os primeiros blocos do lote
+                if window is not None:
+                    take = min(blocks_per_window - window[3], n_blocks)
+                    window = (window[0] + counts[:take].sum(), window[1] + sums[:take].sum(axis=0),
+                              window[2] + cross[:take].sum(axis=0), window[3] + take)
+                    position = take
+                    if window[3] == blocks_per_window:
+                        completed.append((window[0][None], window[1][None], window[2][None]))
+                        window = None
+
+                # Janelas inteiras dentro do lote
+                n_windows = (n_blocks - position) // blocks_per_window
+                stop = position + n_windows * blocks_per_window
+                if n_windows > 0:
+                    completed.append((counts[position:stop].reshape(n_windows, blocks_per_window).sum(axis=1),
+                                      sums[position:stop].reshape(n_windows, blocks_per_window, *sums.shape[1:]).sum(axis=1),
+                                      cross[position:stop].reshape(n_windows, blocks_per_window, cross.shape[1]).sum(axis=1)))
+
+                # Blocos restantes abrem a próxima janela
+                if stop < n_blocks:
+                    window = (counts[stop:].sum(), sums[stop:].sum(axis=0), cross[stop:].sum(axis=0), n_blocks - stop)
+                open_windows[slice_size] = window
+
+                if not completed:
+                    continue
+                moments = tuple(np.concatenate(parts) for parts in zip(*completed))
+                with self.utils.instrumentation.accumulate('dccm', window=slice_size):
+                    dados_compactados = self.dccmFromMoments(*moments)
+                yield slice_size, dados_compactados
+
+                if slice_size != pyramid_base:
+                    continue
+                # Sobe a pirâmide enquanto as fusões completarem janelas, o último nível é o primeiro sem nenhuma janela
+                level_size = slice_size
+                while True:
+                    moments, halves[level_size] = self.mergeMomentPairs(moments, halves.get(level_size))
+                    level_size *= 2
+                    if len(moments[0]) == 0:
+                        break
+                    with self.utils.instrumentation.accumulate('dccm', window=level_size):
+                        dados_compactados = self.dccmFromMoments(*moments)
+                    yield level_size, dados_compactados
+
+    def iterBlockMoments(self, traj, block_size, batch_blocks=64):
+        # Gera os momentos dos blocos em lotes de até 'batch_blocks' blocos, na ordem da trajetória
+        # 'traj' pode ser a trajetória em memória ou um iterável de pedaços (chunks) de frames, como no modo streaming
+        chunks = [traj] if isinstance(traj, np.ndarray) else traj
+
+        reference = None
+        pending = None
+        n_atoms = traj.shape[1] if isinstance(traj, np.ndarray) else 0
+        yielded = False
+        for chunk in chunks:
+            if len(chunk) == 0:
+                continue
+            if reference is None:
+                # As coordenadas são deslocadas pelo frame 0 (referência do alinhamento) e acumuladas em float64,
+                # evitando o cancelamento numérico de <r_i·r_k> - <r_i>·<r_k> com coordenadas absolutas
+                reference = np.asarray(chunk[0], dtype=np.float64)
+
+            # Frames que sobraram do chunk anterior completam o primeiro bloco deste
+            if pending is not None and len(pending) > 0:
+                chunk = np.concatenate([pending, chunk])
+            n_frames, n_atoms, _ = chunk.shape
+            n_blocks = n_frames // block_size
+
+            # Processa os blocos em lotes, limitando a cópia em float64 a 'batch_blocks' blocos
+            for start in range(0, n_blocks, batch_blocks):
+                stop = min(start + batch_blocks, n_blocks)
+                blocks = np.asarray(chunk[start*block_size:stop*block_size], dtype=np.float64) - reference
+                blocks = blocks.reshape(stop - start, block_size, n_atoms, 3)
+
+                # (n_blocks, n_frames, n_atoms, 3) -> (n_blocks, n_atoms, n_frames * 3), o produto soma sobre frames e coordenadas
+                blocks_flat = blocks.transpose(0, 2, 1, 3).reshape(stop - start, n_atoms, -1)
+                cross = self.packedGram(blocks_flat, np.empty((stop - start, n_atoms * (n_atoms + 1) // 2)))
+                yield np.full(stop - start, block_size, dtype=np.int64), blocks.sum(axis=1), cross
+                yielded = True
+
+            pending = chunk[n_blocks*block_size:]
+
+        if not yielded:
+            # Nenhum bloco completo (trajetória menor que o bloco), um lote vazio mantém o formato (0, num_elementos_triangulo)
+            yield (np.zeros(0, dtype=np.int64), np.zeros((0, n_atoms, 3)), np.zeros((0, n_atoms * (n_atoms + 1) // 2)))
+
+    def calculateSlidingDCCM(self, traj, window, stride, batch_windows=64, refresh=256):
+        # Todas as janelas deslizantes em uma única pilha (n_janelas, num_elementos_triangulo)
+        batches = list(self.iterSlidingDCCM(traj, window, stride, batch_windows, refresh))
+        if not batches:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(batches)
+
+    def iterSlidingDCCM(self, traj, window, stride, batch_windows=64, refresh=256):
+        # Gera lotes de até 'batch_windows' janelas deslizantes (sobrepostas) de 'window' frames, uma nova janela a cada 'stride' frames
+        # Os momentos são acumulados em blocos de gcd(window, stride) frames e a soma da janela é atualizada
+        # somando os blocos que entram e subtraindo os que saem, O(N²·stride) por janela ao invés de O(N²·window)
+        if window <= 0 or stride <= 0:
+            raise ValueError(f"Janela ({window}) e passo ({stride}) devem ser positivos")
+        block_size = math.gcd(window, stride)
+        blocks_per_window = window // block_size
+        blocks_per_stride = stride // block_size
+
+        ring = collections.deque()
+        total_count, total_sums, total_cross = 0, None, None
+        n_blocks = 0
+        n_windows = 0
+        pending = ([], [], [])
+        for counts, sums, cross in self.iterBlockMoments(traj, block_size):
+            for b in range(len(counts)):
+                # Bloco que entra na janela
+                ring.append((counts[b], sums[b], cross[b]))
+                if total_sums is None:
+                    total_sums, total_cross = np.zeros_like(sums[b]), np.zeros_like(cross[b])
+                total_count += counts[b]
+                total_sums += sums[b]
+                total_cross += cross[b]
+
+                # Bloco que sai da janela
+                if len(ring) > blocks_per_window:
+                    leaving_count, leaving_sums, leaving_cross = ring.popleft()
+                    total_count -= leaving_count
+                    total_sums -= leaving_sums
+                    total_cross -= leaving_cross
+                n_blocks += 1
+
+                # Após completar a primeira janela, uma nova janela termina a cada 'stride' frames
+                if n_blocks < blocks_per_window or (n_blocks - blocks_per_window) % blocks_per_stride != 0:
+                    continue
+                n_windows += 1
+                if n_windows % refresh == 0:
+                    # Recalcula a soma a partir dos blocos da janela, evitando o acúmulo de erro das subtrações
+                    total_sums = np.sum([block[1] for block in ring], axis=0)
+                    total_cross = np.sum([block[2] for block in ring], axis=0)
+
+                pending[0].append(total_count)
+                pending[1].append(total_sums.copy())
+                pending[2].append(total_cross.copy())
+                if len(pending[0]) == batch_windows:
+                    with self.utils.instrumentation.accumulate('dccm', window=window, stride=stride):
+                        dados_compactados = self.dccmFromMoments(np.array(pending[0]), np.stack(pending[1]), np.stack(pending[2]))
+                    yield dados_compactados
+                    pending = ([], [], [])
+
+        if pending[0]:
+            with self.utils.instrumentation.accumulate('dccm', window=window, stride=stride):
+                dados_compactados = self.dccmFromMoments(np.array(pending[0]), np.stack(pending[1]), np.stack(pending[2]))
+            yield dados_compactados
+
+    def calculateLaggedDCCM(self, sliced_traj, max_lag, batch_size=8, block_bytes=256 * 1024 * 1024):
+        # DCCM com atraso de cada fatia para todos os lags de -max_lag a max_lag, (2*max_lag + 1, n_slices, num_elementos_triangulo)
+        #   C_ik(τ) = <Δr_i(t)·Δr_k(t+τ)> / sqrt(<Δr_i²>·<Δr_k²>)
+        # τ > 0 indica que o movimento de i antecede o de k, e C_ik(-τ) = C_ki(τ), portanto o triângulo superior dos lags
+        # negativos guarda o triângulo inferior dos positivos. A média de cada lag usa apenas os n_frames - |τ| pares de frames
+        # e as variâncias são as da janela inteira, no lag 0 o resultado é o mesmo do calculateDCCM
+        # Todos os lags saem de uma correlação por FFT das flutuações, O(N²·T·log T) ao invés de O(N²·T·max_lag)
+        n_slices, n_frames, n_atoms, _ = sliced_traj.shape
+        if max_lag >= n_frames:
+            raise ValueError(f"Lag máximo ({max_lag}) deve ser menor que a janela ({n_frames} frames)")
+        xp = self.backend.xp
+
+        # Preenchimento com zeros até ao menos n_frames + max_lag evita que a correlação circular da FFT misture os lags
+        n_fft = 1 << (n_frames + max_lag - 1).bit_length()
+        lags = np.arange(-max_lag, max_lag + 1)
+        # Posição de cada lag na saída da FFT inversa, lags negativos ficam no final
+        lag_index = xp.asarray(lags % n_fft)
+        overlap = xp.asarray((n_frames - np.abs(lags)).astype(np.float32))
+
+        out = np.empty((len(lags), n_slices, n_atoms * (n_atoms + 1) // 2), dtype=np.float32)
+        for start in range(0, n_slices, batch_size):
+            stop = min(start + batch_size, n_slices)
+            coords = self.backend.asarray(sliced_traj[start:stop], dtype=xp.float32)
+            fluctuations = coords - xp.mean(coords, axis=1, keepdims=True)
+            diag_sqrt = xp.sqrt(xp.sum(fluctuations ** 2, axis=(1, 3)) / n_frames + 1e-10)
+
+            # Espectro de cada átomo e coordenada, (n, n_freq, n_atoms, 3)
+            spectra = xp.fft.rfft(fluctuations, n=n_fft, axis=1)
+
+            # Espectro cruzado Σ_j conj(F_ij)·F_kj de um bloco de linhas por vez, limitado a 'block_bytes'
+            block_rows = max(1, block_bytes // (spectra.shape[1] * n_atoms * (stop - start) * spectra.itemsize))
+            for r0 in range(0, n_atoms, block_rows):
+                r1 = min(r0 + block_rows, n_atoms)
+                cross = xp.matmul(spectra[:, :, r0:r1].conj(), spectra[:, :, r0:].transpose(0, 1, 3, 2))
+                correlation = xp.fft.irfft(cross, n=n_fft, axis=1)[:, lag_index]
+                correlation /= overlap[None, :, None, None]
+                correlation /= diag_sqrt[:, None, r0:r1, None]
+                correlation /= diag_sqrt[:, None, None, r0:]
+                block = self.backend.toHost(correlation)
+                for i in range(r0, r1):
+                    offset = self.packedRowOffset(i, n_atoms)
+                    out[:, start:stop, offset:offset + n_atoms - i] = block[:, :, i - r0, i - r0:].transpose(1, 0, 2)
+        return out
+
+    def dccmFromMoments(self, counts, sums, cross):
+        # Converte os momentos somados de cada janela na DCCM normalizada, no layout compactado
+        # C_ik = <r_i·r_k> - <r_i>·<r_k>
+        if self.backend.fused:
+            return self.backend.dccmFromMoments(counts, sums, cross)
+        n_windows, n_atoms, _ = sums.shape
+        n = counts.astype(np.float64)[:, None]
+        mean_coords = sums / n[:, :, None]
+
+        # <r_i>·<r_k> também calculado apenas no triângulo superior
+        mean_products = np.empty_like(cross)
+        self.packedGram(mean_coords, mean_products)
+
+        cov_packed = cross / n
+        cov_packed -= mean_products
+
+        # Mesma normalização do calculateDCCM
+        self.normalizePacked(cov_packed, n_atoms)
+        return cov_packed.astype(np.float32)
 
     def calculateDCCMxyz(self, traj):
         n_frames, n_atoms, _ = traj.shape
-        coords = np.asarray(traj, dtype=np.float32)
+        xp = self.backend.xp
+        coords = self.backend.asarray(traj, dtype=xp.float32)
     
-        mean_coords = np.mean(coords, axis=0)
+        mean_coords = xp.mean(coords, axis=0)
         
         fluctuations = coords - mean_coords
 
@@ -146,36 +992,38 @@ class Algorithms:
         
         # Calcular a matriz de covariância
         # (N_atoms*3, N_frames) @ (N_frames, N_atoms*3) -> (N_atoms*3, N_atoms*3)
-        cov_matrix = np.dot(fluctuations_reshaped.T, fluctuations_reshaped) / n_frames
+        cov_matrix = xp.dot(fluctuations_reshaped.T, fluctuations_reshaped) / n_frames
     
         # Normalizar a matriz de covariância para obter a matriz DCC
         # Extrair a diagonal (variâncias)
-        diag = np.diag(cov_matrix)
+        diag = xp.diag(cov_matrix)
         
         # Adicionar um pequeno valor para evitar a divisão por zero no caso de variância nula
-        diag_sqrt = np.sqrt(diag + 1e-10)
+        diag_sqrt = xp.sqrt(diag + 1e-10)
 
     
         # Calcular a matriz de normalização usando um produto externo
-        norm_matrix = np.outer(diag_sqrt, diag_sqrt)
+        norm_matrix = xp.outer(diag_sqrt, diag_sqrt)
         
         # Realizar a divisão elemento a elemento
-        dcc_matrix_cpu = cov_matrix / norm_matrix
+        dcc_matrix = cov_matrix / norm_matrix
     
         
-        return dcc_matrix_cpu
+        # Transfere a matriz para a CPU, quando o backend não é o numpy
+        return self.backend.toHost(dcc_matrix)
 
     
     
     def calculateDCCM(self, traj_slice: np.ndarray) -> np.ndarray:
 
         n_frames, n_atoms, _ = traj_slice.shape
+        xp = self.backend.xp
         
         # Assure datatype
-        coords = np.asarray(traj_slice, dtype=np.float32)
+        coords = self.backend.asarray(traj_slice, dtype=xp.float32)
 
         # Calcular posição média
-        mean_coords = np.mean(coords, axis=0) 
+        mean_coords = xp.mean(coords, axis=0) 
 
         # Calcular flutuaçãos a partir da média
         # (n_frames, n_atoms, 3) - (n_atoms, 3) -> (n_frames, n_atoms, 3)
@@ -189,22 +1037,22 @@ class Algorithms:
         #    Some (Σ) sobre os frames (t) e sobre as coordenadas (j)...
         #    O produto de fluctuation[t, i, j] * fluctuation[t, k, j]
         # Isto é: C_ik = <Δr_i ⋅ Δr_k>
-        cov_matrix = np.einsum('tij,tkj->ik', fluctuations, fluctuations) / n_frames
+        cov_matrix = xp.einsum('tij,tkj->ik', fluctuations, fluctuations) / n_frames
         
         # Normalizar covariância/dividir pela variância
-        diag = np.diag(cov_matrix)
+        diag = xp.diag(cov_matrix)
 
         # Trata divisão por 0 e tira a raiz quadrada
-        diag_sqrt = np.sqrt(diag + 1e-10)
+        diag_sqrt = xp.sqrt(diag + 1e-10)
         
         # Normalizar matriz para cada elemento
-        norm_matrix = np.outer(diag_sqrt, diag_sqrt)
+        norm_matrix = xp.outer(diag_sqrt, diag_sqrt)
         
         # Normalizar covariâncias
-        dccm_matrix_cpu = cov_matrix / norm_matrix
-
+        dccm_matrix = cov_matrix / norm_matrix
 
-        return dccm_matrix_cpu
+        # Transfere a matriz para a CPU, quando o backend não é o numpy
+        return self.backend.toHost(dccm_matrix)
 
     def plotAndSaveDCCM(self, dccm_matrix, output_path, slice_index):
         # Salvar imagem/gráfico/heatmap
@@ -231,38 +1079,225 @@ class Algorithms:
                 txt_file.write(f"{']' if frame == (len(covariances) - 1 ) else '],'}")
             txt_file.write("]")
         
+def listReplicas(trajectory_data_path):
+    # Lista os pares (sistema, réplica) presentes nos dados, no formato ../dados/<sistema>/Rep_*
+    main_folders = [d for d in os.listdir(trajectory_data_path) if os.path.isdir(os.path.join(trajectory_data_path, d)) and not d.startswith('.')]
+
+    replicas = []
+    for folder in sorted(main_folders):
+        folder_path = os.path.join(trajectory_data_path, folder)
+        for replica in sorted(r for r in os.listdir(folder_path) if os.path.isdir(os.path.join(folder_path, r)) and r.startswith('Rep_')):
+            replicas.append((folder, replica, os.path.join(folder_path, replica)))
+    return replicas
+
+def limitBlasThreads(threads):
+    # Executado ao iniciar cada processo do pool, as variáveis de ambiente já foram herdadas do processo principal,
+    # caso o threadpoolctl esteja instalado o limite também é aplicado às bibliotecas já carregadas
+    global _blas_limits
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    _blas_limits = threadpool_limits(limits=threads)
+
+def runJob(job):
+    # Uma tarefa independente: uma réplica de um sistema, com todas as janelas ou apenas uma
+    system, replica, replica_path, slice_sizes, options, app_settings = job
+    start = time.perf_counter()
+    app = dataTranformer(**app_settings)
+    app.instrumentation.setContext(system=system, replica=replica)
+    with app.instrumentation.stage('job', profile=False, windows=slice_sizes):
+        app.algs.processTrajectory(replica_path, slice_sizes=slice_sizes, **options)
+    return time.perf_counter() - start
+
+def parseDomain(value):
+    # NOME:INICIO-FIM -> (nome, início, fim), o nome é gravado nos 4 bytes de nome de cada ponto do .bin
+    try:
+        label, residues = value.split(':')
+        first, last = (int(part) for part in residues.split('-'))
+    except ValueError:
+        raise ValueError(f"Domínio '{value}' não está no formato NOME:INICIO-FIM (ex: N:1-120)")
+    if not label or len(label.encode('utf-8')) > NAME_BYTES:
+        raise ValueError(f"O nome do domínio '{value}' deve ter de 1 a {NAME_BYTES} bytes (ex: N, C, NTD)")
+    if first > last:
+        raise ValueError(f"O domínio '{value}' termina antes de começar")
+    return label, first, last
+
+def domainRange(value):
+    # Tipo do --domains, verificado antes das tarefas e mantido como texto (registrado no manifesto)
+    try:
+        parseDomain(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+def windowStride(value):
+    # Par JANELA:PASSO do --sliding, ambos inteiros positivos
+    try:
+        window, stride = (int(part) for part in value.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' não está no formato JANELA:PASSO (ex: 100:10)")
+    if window <= 0 or stride <= 0:
+        raise argparse.ArgumentTypeError(f"Janela e passo de '{value}' devem ser inteiros positivos")
+    return window, stride
+
 def main() -> int:
 
-    # Instanciando a classe principal
-    app = dataTranformer()
+    parser = argparse.ArgumentParser(description='Pré-processamento das trajetórias em arquivos DCCM fatiados')
+    parser.add_argument('--data', default='../dados', help='Pasta com os sistemas e réplicas')
+    parser.add_argument('--slice-sizes', type=int, nargs='+', default=SLICE_SIZES, help='Tamanhos de janela, em frames')
+    parser.add_argument('--streaming', action='store_true', help='Lê a trajetória em pedaços, sem carregá-la inteira em memória')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Frames por pedaço no modo streaming')
+    parser.add_argument('--workers', type=int, default=1, help='Número de processos executando tarefas em paralelo')
+    parser.add_argument('--blas-threads', type=int, default=None, help='Threads de BLAS por processo (padrão: núcleos / workers)')
+    parser.add_argument('--container', action='store_true', help='Também escreve dccm_data.dccm, com todas as janelas e índice de fatias')
+    parser.add_argument('--encoding', choices=sorted(ENCODINGS), default='float32', help='Codificação dos valores de correlação (tipo_dado_id)')
+    parser.add_argument('--compression', choices=sorted(COMPRESSIONS), default='none', help='Compressão de cada fatia no container')
+    parser.add_argument('--sliding', nargs='+', type=windowStride, default=[], metavar='JANELA:PASSO',
+                        help='Janelas deslizantes (sobrepostas), ex: 100:10 gera dccm_data_100_stride_10.bin')
+    parser.add_argument('--pyramid', action='store_true', help='Também escreve dccm_pyramid.dccm, com níveis dobrando a partir da menor janela')
+    parser.add_argument('--sparse-threshold', type=float, default=None, help='Também escreve dccm_sparse_*.bin com as correlações |c| >= limiar')
+    parser.add_argument('--sparse-top-k', type=int, default=None, help='Também escreve dccm_sparse_*.bin com as k maiores correlações de cada resíduo')
+    parser.add_argument('--max-lag', type=int, default=None, metavar='TAU',
+                        help='Também escreve a DCCM com atraso de -TAU a TAU frames (via FFT), ex: dccm_lag_100_t-5.bin ... dccm_lag_100_t5.bin')
+    parser.add_argument('--backend', choices=['auto'] + sorted(BACKENDS), default='auto',
+                        help="Backend de arrays dos kernels, 'auto' usa a GPU (cupy) quando disponível e o numpy caso contrário")
+    parser.add_argument('--metrics', default=None, help='Arquivo JSON-lines com tempo de parede, CPU e memória de cada etapa')
+    parser.add_argument('--profile', choices=PROFILE_MODES, default=None,
+                        help="Gancho de profile por etapa: 'cprofile' salva um .prof por etapa, 'tracemalloc' registra o pico de memória alocada")
+    parser.add_argument('--trajectory-file', default='traj_CA.xtc', help='Trajetória de cada réplica (ex: protein_md.xtc com todos os átomos)')
+    parser.add_argument('--topology-file', default='protein_CA_only.gro', help='Topologia de cada réplica (ex: protein_md.gro)')
+    parser.add_argument('--selection', default=None, help="Seleção de átomos do mdtraj, ex: 'name CA' ou 'protein and not element H'")
+    parser.add_argument('--coarse-grain', choices=COARSE_GRAIN_MODES, default='atom', help='Agrega os átomos selecionados por resíduo ou domínio')
+    parser.add_argument('--weighting', choices=WEIGHTING_MODES, default='centroid', help='Centroide ou centro de massa de cada grupo')
+    parser.add_argument('--domains', nargs='+', type=domainRange, default=None, metavar='NOME:INICIO-FIM', help='Domínios para --coarse-grain domain, ex: N:1-120 C:121-250')
+    parser.add_argument('--coordinate-cache', action='store_true',
+                        help='Guarda as coordenadas alinhadas em aligned_CA.npy, execuções seguintes não leem nem alinham o XTC novamente')
+    parser.add_argument('--ensemble', action='store_true', help='Após as réplicas, agrega média, desvio padrão e concordância de sinal de cada sistema')
+    parser.add_argument('--differential', nargs='*', default=None, metavar='A:B',
+                        help='DCCM diferencial (A - B) e estatística t de Welch entre réplicas, sem pares usa X_lig:X e mutante:wt')
+    parser.add_argument('--events', action='store_true',
+                        help='Após as réplicas, escreve ao lado de cada dccm_data_*.bin um índice JSON das fatias com mudanças bruscas (*_events.json)')
+    parser.add_argument('--events-threshold', type=float, default=3.5, help='z-score robusto mínimo da distância para a fatia anterior de um evento')
+    parser.add_argument('--events-top-pairs', type=int, default=10, help='Pares de resíduos que mais mudaram registrados em cada evento')
+    parser.add_argument('--force', action='store_true', help='Recalcula todos os arquivos, ignorando o manifesto de cada réplica')
+    parser.add_argument('--split-windows', action='store_true', help='Uma tarefa por janela, ao invés de uma tarefa por réplica com todas as janelas em uma passada')
+    args = parser.parse_args()
+    if args.compression != 'none' and not (args.container or args.pyramid):
+        # Os arquivos .bin não são comprimidos, apenas as fatias do container e da pirâmide
+        parser.error('--compression só se aplica ao --container e à --pyramid')
+    if not compressionAvailable(COMPRESSIONS[args.compression]):
+        # Verificado antes das réplicas, ao invés de todas as tarefas falharem ao escrever o container
+        parser.error(f"--compression {args.compression} necessita do pacote 'zstandard' (pip install zstandard)")
 
     # Define o caminho dos dados
-    trajectory_data_path = '../dados'
+    trajectory_data_path = args.data
     
-    # Lista os sistemas presentes nos dados
-    main_folders = None
+    # Lista os sistemas e réplicas presentes nos dados
     try:
-        main_folders = [d for d in os.listdir(trajectory_data_path) if os.path.isdir(os.path.join(trajectory_data_path, d)) and not d.startswith('.')]
+        replicas = listReplicas(trajectory_data_path)
     except FileNotFoundError:
-        print(f"Error: The directory '{base_dir}' was not found.")
-        exit()
+        print(f"Error: The directory '{trajectory_data_path}' was not found.")
+        return 1
 
-    
-    for folder in sorted(main_folders):
-        folder_path = os.path.join(trajectory_data_path, folder)
-        print('System', folder)
+    pairs = []
+    if args.differential is not None:
+        # Os pares são verificados antes das tarefas, ao invés de falharem depois de todas as réplicas processadas
+        systems = {system for system, _, _ in replicas}
+        for pair in args.differential:
+            pair_systems = pair.split(':')
+            if len(pair_systems) != 2 or not all(pair_systems):
+                parser.error(f"--differential '{pair}' não está no formato A:B (ex: asp84glu:wt)")
+            missing = [system for system in pair_systems if system not in systems]
+            if missing:
+                parser.error(f"--differential '{pair}': {', '.join(missing)} sem réplicas (Rep_*) em '{trajectory_data_path}'")
+            pairs.append(tuple(pair_systems))
+        pairs = pairs or defaultPairs(systems)
 
-        # Lista as réplicas presentes no sistema
-        replicas = [r for r in os.listdir(folder_path) if os.path.isdir(os.path.join(folder_path, r)) and r.startswith('Rep_')]
-        
-        for replica in sorted(replicas):
-            print('Replica', replica)
-            replica_path = os.path.join(folder_path, replica)
-
-            # Aplica o algoritmo para cada sistema e réplica presente dos dados
-            app.algs.processTrajectory(replica_path)
-                
-    return 0
+    # Cada réplica é independente, por padrão uma tarefa calcula todas as janelas em uma única passada pela trajetória
+    options = {'streaming': args.streaming, 'chunk_size': args.chunk_size, 'force': args.force, 'container': args.container,
+               'encoding': args.encoding, 'compression': args.compression,
+               'pyramid': args.pyramid, 'max_lag': args.max_lag, 'sparse_threshold': args.sparse_threshold, 'sparse_top_k': args.sparse_top_k,
+               'coordinate_cache': args.coordinate_cache,
+               'trajectory_file': args.trajectory_file, 'topology_file': args.topology_file, 'selection': args.selection,
+               'coarse_grain': args.coarse_grain, 'weighting': args.weighting, 'domains': args.domains,
+               'sliding': args.sliding}
+    # O backend é resolvido uma única vez, todos os processos usam o mesmo
+    try:
+        backend = getBackend(args.backend).name
+    except RuntimeError as e:
+        # Ex: --backend cupy (ou transformer_cup.py) em uma máquina sem GPU
+        parser.error(str(e))
+    print(f"Backend: {backend}")
+    app_settings = {'backend': backend, 'metrics': args.metrics, 'profile': args.profile}
+    if args.split_windows:
+        # Uma tarefa por janela para os arquivos de cada janela, as saídas que reúnem todas as janelas (REPLICA_OUTPUTS)
+        # ficam em uma única tarefa da réplica, com todas as janelas, ao invés de cada janela sobrescrever o mesmo arquivo
+        window_options = dict(options, **REPLICA_OUTPUTS)
+        replica_options = dict(options, window_files=False)
+        replica_outputs = any(options[key] != off for key, off in REPLICA_OUTPUTS.items())
+        jobs = []
+        for system, replica, replica_path in replicas:
+            jobs.extend((system, replica, replica_path, [slice_size], window_options, app_settings) for slice_size in args.slice_sizes)
+            if replica_outputs:
+                jobs.append((system, replica, replica_path, args.slice_sizes, replica_options, app_settings))
+    else:
+        jobs = [(system, replica, replica_path, args.slice_sizes, options, app_settings) for system, replica, replica_path in replicas]
+
+    failures = 0
+    total_start = time.perf_counter()
+    if args.workers <= 1:
+        for job in jobs:
+            print('System', job[0], 'Replica', job[1])
+
+            # Aplica o algoritmo para cada sistema e réplica presente dos dados, uma réplica com erro não interrompe as demais
+            try:
+                elapsed = runJob(job)
+            except Exception as e:
+                failures += 1
+                print(f"Tarefa {job[0]}/{job[1]} janelas {job[3]} falhou: {e}")
+                continue
+            print(f"Tarefa {job[0]}/{job[1]} janelas {job[3]}: {elapsed:.2f} s")
+    else:
+        # Divide os núcleos entre os processos, evitando que cada um abra uma thread de BLAS por núcleo
+        threads = args.blas_threads or max(1, (os.cpu_count() or 1) // args.workers)
+        for variable in BLAS_THREAD_VARIABLES:
+            os.environ[variable] = str(threads)
+
+        # 'spawn' garante que cada processo importe o numpy já com as variáveis de ambiente acima
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers, mp_context=context,
+                                                    initializer=limitBlasThreads, initargs=(threads,)) as pool:
+            futures = {pool.submit(runJob, job): job for job in jobs}
+            for future in concurrent.futures.as_completed(futures):
+                job = futures[future]
+                try:
+                    elapsed = future.result()
+                except Exception as e:
+                    failures += 1
+                    print(f"Tarefa {job[0]}/{job[1]} janelas {job[3]} falhou: {e}")
+                    continue
+                print(f"Tarefa {job[0]}/{job[1]} janelas {job[3]}: {elapsed:.2f} s")
+
+    print(f"{len(jobs)} tarefas concluídas em {time.perf_counter() - total_start:.2f} s")
+
+    if args.ensemble:
+        # Agregação das réplicas de cada sistema, depois que todas as réplicas foram processadas
+        app = dataTranformer()
+        for system in sorted({system for system, _, _ in replicas}):
+            app.ensemble.aggregateSystem(os.path.join(trajectory_data_path, system), args.slice_sizes)
+
+    if args.differential is not None:
+        app = dataTranformer()
+        for system_a, system_b in pairs:
+            app.differential.comparePair(trajectory_data_path, system_a, system_b, args.slice_sizes)
+
+    if args.events:
+        # Índice de eventos de cada réplica, a partir dos arquivos já escritos
+        app = dataTranformer()
+        for _, _, replica_path in replicas:
+            app.events.indexReplica(replica_path, args.events_threshold, args.events_top_pairs)
+    return 1 if failures else 0
 
 if __name__ == '__main__':
     sys.exit(main()) 
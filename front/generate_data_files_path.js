@@ -41,8 +41,9 @@ try {
         for (const replicaFolder of replicaFolders) {
             const replicaPath = path.join(dataDirReplica, replicaFolder);
             
+            // Os arquivos esparsos (dccm_sparse_*.bin, tipo_dado_id 4) não são lidos pelo visualizador
             const replicaFiles = fs.readdirSync(replicaPath)
-                .filter(file => path.extname(file).toLowerCase() === '.bin');
+                .filter(file => path.extname(file).toLowerCase() === '.bin' && !file.startsWith('dccm_sparse_'));
 
             simulationData[simFolder][replicaFolder] = {};
 
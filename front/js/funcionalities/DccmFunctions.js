@@ -46,6 +46,12 @@ class DccmFunctions {
         let rawData;
         if (dataTypeId === 1) {
             rawData = new Float32Array(arrayBuffer, dataOffset);
+        } else if (dataTypeId === 2) {
+            // float16, convertido para float32
+            rawData = this.float16ToFloat32(new Uint16Array(arrayBuffer, dataOffset));
+        } else if (dataTypeId === 3) {
+            // int8 com escala fixa (valor * 127)
+            rawData = Float32Array.from(new Int8Array(arrayBuffer, dataOffset), (value) => value / 127);
         } else {
             throw new Error(`Tipo de dado não suportado: ${dataTypeId}`);
         }
@@ -87,6 +93,25 @@ class DccmFunctions {
         };
     }
 
+    // Converte os bits de valores float16 (IEEE 754 meia precisão) para float32
+    float16ToFloat32(halfs) {
+        const values = new Float32Array(halfs.length);
+        for (let i = 0; i < halfs.length; i++) {
+            const half = halfs[i];
+            const sign = (half & 0x8000) ? -1 : 1;
+            const exponent = (half >> 10) & 0x1f;
+            const fraction = half & 0x03ff;
+            if (exponent === 0) {
+                values[i] = sign * Math.pow(2, -14) * (fraction / 1024);
+            } else if (exponent === 0x1f) {
+                values[i] = fraction ? NaN : sign * Infinity;
+            } else {
+                values[i] = sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+            }
+        }
+        return values;
+    }
+
     // Teste com números aleatórios na matriz de correlação
     createRandomDCCM( size ) {
         var random_DCCM_columns = new Array();